@@ -0,0 +1,225 @@
+#!/usr/bin/python
+
+#
+# benchInitReport.py
+#
+#    This script times dailyInitReport.py on synthetic ucm logs written by
+#    genUcmLogs.py. The command line options are as follows:
+#
+#        --workdir=<abspath>    the directory the logs and reports are written under
+#                               (default a new temporary directory, removed afterwards)
+#        --scales=KB,KB,...     the log file sizes to time (default 256,1024,4096)
+#        --chains=N             the number of :n3d chains at each scale (default 2)
+#        --chainlen=N           the number of log files in each chain (default 3)
+#        --runs=N               the number of runs per log file (default 3)
+#        --absy=N               the number of ":cap is" entries per run (default 10)
+#        --repeat=N             time each step N times and keep the fastest (default 3)
+#        --seed=N               the random seed of the generated logs
+#
+#    At each scale the log files are indexed, each stage class from
+#    BarcodeData through DataCollection is timed on every run, and then
+#    ProcessLogChain and the whole directory loop (ProcessLogDir) are timed
+#    end to end, the latter once with --format=json and once writing pdf
+#    reports. Every step starts from a new LogChainResolver, so no step
+#    reuses a log index built by the one before it. The results are
+#    printed as a table with the time of each step and its throughput in
+#    MB of log per second and reports per second.
+
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+from optparse import OptionParser
+
+import dailyInitReport
+import genUcmLogs
+
+# the stage classes in the order InitReport evaluates them
+BenchStages = ( "BarcodeData", "FindCapillary", "IlluminationCameraCalibration",
+	"PressureVelocityTest", "CapillaryCalibration", "DataCollection" )
+
+class BenchResult:
+	def __init__( self, scale, logBytes, reports ):
+		self._scale = scale
+		self._logBytes = logBytes
+		self._reports = reports
+		self._steps = []
+
+	def Add( self, step, seconds ):
+		self._steps.append(( step, seconds ))
+
+	def GetReport( self ):
+		mb = self._logBytes / ( 1024.0 * 1024.0 )
+		lines = [ "scale %d KB per log file, %.1f MB of log, %d reports" % ( self._scale, mb, self._reports ),
+			"  %-32s %10s %10s %12s" % ( "step", "seconds", "MB/s", "reports/s" )]
+		for step, seconds in self._steps:
+			seconds = max( seconds, 1e-9 )
+			lines.append( "  %-32s %10.4f %10.1f %12.1f" % ( step, seconds, mb / seconds, self._reports / seconds ))
+		return "\n".join( lines )
+
+def GetConfig( logdir, rptdir, format ):
+	# RunTimeConfig reads the command line, so give it one
+	argv = sys.argv
+	sys.argv = [ "dailyInitReport.py", "--instr=cct032", "--logdir=" + logdir, "--rptdir=" + rptdir, "--format=" + format, "--force" ]
+	try:
+		return dailyInitReport.RunTimeConfig( )
+	finally:
+		sys.argv = argv
+
+def ResetResolver( config ):
+	# drop every log index, the next step builds its own
+	dailyInitReport.GetLogResolver( config ).Close( )
+	dailyInitReport.logResolver = None
+
+def TimeDirectory( config, repeat ):
+	best = None
+	for i in range( repeat ):
+		ResetResolver( config )
+		start = time.time( )
+		dailyInitReport.ProcessLogDir( config )
+		seconds = time.time( ) - start
+		if(( best == None ) or ( seconds < best )):
+			best = seconds
+	return best
+
+def TimeChains( config, chains, repeat ):
+	best = None
+	for i in range( repeat ):
+		ResetResolver( config )
+		start = time.time( )
+		for chain in chains:
+			dailyInitReport.ProcessLogChain( chain, config )
+		seconds = time.time( ) - start
+		if(( best == None ) or ( seconds < best )):
+			best = seconds
+	return best
+
+def TimeIndex( config, chains, repeat ):
+	best = None
+	for i in range( repeat ):
+		ResetResolver( config )
+		resolver = dailyInitReport.GetLogResolver( config )
+		start = time.time( )
+		for chain in chains:
+			for logFname in chain:
+				resolver.Open( config.LogDir( ) + "/" + logFname )
+		seconds = time.time( ) - start
+		if(( best == None ) or ( seconds < best )):
+			best = seconds
+	return best
+
+def TimeStages( config, chains, repeat ):
+	# the stages are run the way InitReport runs them, each one on every
+	# run of every chain, from logs that are already indexed
+	best = dict.fromkeys( BenchStages )
+	for i in range( repeat ):
+		ResetResolver( config )
+		runs = []
+		for chain in chains:
+			runs += dailyInitReport.PlanRuns( config, chain )
+
+		seconds = dict.fromkeys( BenchStages, 0.0 )
+		for logFname, run, last, window, mm, userStartIndex in runs:
+			try:
+				start = time.time( )
+				dailyInitReport.BarcodeData( window, mm, userStartIndex )
+				seconds[ "BarcodeData" ] += time.time( ) - start
+
+				start = time.time( )
+				dailyInitReport.FindCapillary( window, mm, userStartIndex )
+				seconds[ "FindCapillary" ] += time.time( ) - start
+
+				start = time.time( )
+				dailyInitReport.IlluminationCameraCalibration( window, mm, userStartIndex )
+				seconds[ "IlluminationCameraCalibration" ] += time.time( ) - start
+
+				start = time.time( )
+				pvTest = dailyInitReport.PressureVelocityTest( window, mm, userStartIndex )
+				seconds[ "PressureVelocityTest" ] += time.time( ) - start
+
+				start = time.time( )
+				capCal = dailyInitReport.CapillaryCalibration( window, pvTest.GetMMap( ), pvTest.GetIndex( ))
+				seconds[ "CapillaryCalibration" ] += time.time( ) - start
+
+				start = time.time( )
+				dailyInitReport.DataCollection( window, capCal.GetMMap( ), capCal.GetIndex( ))
+				seconds[ "DataCollection" ] += time.time( ) - start
+			except ValueError:
+				# a stage that can't be evaluated ends the run, as in InitReport
+				pass
+
+		for stage in BenchStages:
+			if(( best[ stage ] == None ) or ( seconds[ stage ] < best[ stage ] )):
+				best[ stage ] = seconds[ stage ]
+	return best
+
+def RunScale( options, scale, workdir ):
+	logdir = workdir + "/logs_%d" % scale
+	rptdir = workdir + "/reports_%d" % scale
+	for path in ( logdir, rptdir ):
+		if( os.path.isdir( path )):
+			shutil.rmtree( path )
+	for subdir in ( "by_date", "by_bcode" ):
+		os.makedirs( rptdir + "/" + subdir )
+
+	(genOptions, args) = genUcmLogs.GetOptionParser( ).parse_args([
+		"--logdir=" + logdir, "--size=%d" % scale, "--chains=%d" % options.chains,
+		"--chainlen=%d" % options.chainlen, "--runs=%d" % options.runs,
+		"--absy=%d" % options.absy, "--seed=%d" % options.seed ])
+	genUcmLogs.WriteLogDir( genOptions )
+
+	config = GetConfig( logdir, rptdir, "json" )
+	chains = dailyInitReport.PlanLogDir( config )
+	logBytes = sum( os.path.getsize( logdir + "/" + logFname ) for chain in chains for logFname in chain )
+	reports = sum( len( dailyInitReport.PlanRuns( config, chain )) for chain in chains )
+	result = BenchResult( scale, logBytes, reports )
+
+	result.Add( "IndexedLog (index the logs)", TimeIndex( config, chains, options.repeat ))
+	stageSeconds = TimeStages( config, chains, options.repeat )
+	for stage in BenchStages:
+		result.Add( stage, stageSeconds[ stage ] )
+	result.Add( "ProcessLogChain (json)", TimeChains( config, chains, options.repeat ))
+	result.Add( "ProcessLogDir (json)", TimeDirectory( config, options.repeat ))
+	result.Add( "ProcessLogDir (pdf)", TimeDirectory( GetConfig( logdir, rptdir, "pdf" ), options.repeat ))
+	ResetResolver( config )
+	return result
+
+def RunBench( options ):
+	workdir = options.workdir
+	if( workdir == None ):
+		workdir = tempfile.mkdtemp( prefix="benchInitReport" )
+
+	results = []
+	stdout = sys.stdout
+	stderr = sys.stderr
+	try:
+		for scale in [ int( scale ) for scale in options.scales.split( "," )]:
+			# the reports and their messages are not wanted, only their timing
+			sys.stdout = sys.stderr = open( os.devnull, "w" )
+			try:
+				results.append( RunScale( options, scale, workdir ))
+			finally:
+				sys.stdout.close( )
+				sys.stdout = stdout
+				sys.stderr = stderr
+			print results[ -1 ].GetReport( )
+			print
+	finally:
+		if( options.workdir == None ):
+			shutil.rmtree( workdir )
+	return results
+
+if __name__ == '__main__':
+	parser = OptionParser()
+	parser.add_option( "-w", "--workdir", dest="workdir", help="work directory" )
+	parser.add_option( "--scales", dest="scales", default="256,1024,4096", help="log file sizes (KB)" )
+	parser.add_option( "--chains", dest="chains", type="int", default=2, help="number of n3d chains" )
+	parser.add_option( "--chainlen", dest="chainlen", type="int", default=3, help="log files per chain" )
+	parser.add_option( "--runs", dest="runs", type="int", default=3, help="runs per log file" )
+	parser.add_option( "--absy", dest="absy", type="int", default=10, help="cap is entries per run" )
+	parser.add_option( "--repeat", dest="repeat", type="int", default=3, help="times to repeat each step" )
+	parser.add_option( "--seed", dest="seed", type="int", default=0, help="random seed" )
+	(options, args) = parser.parse_args()
+	RunBench( options )
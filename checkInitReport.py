@@ -0,0 +1,291 @@
+#!/usr/bin/python
+
+#
+# checkInitReport.py
+#
+#    This script checks the faster searches of dailyInitReport.py against
+#    the straightforward code they replaced, on random inputs, and that
+#    processes sharing a day with --shard report each run once. The command
+#    line options are as follows:
+#
+#        --trials=N             the number of random inputs of each check (default 2000)
+#        --seed=N               the random seed of the inputs and the logs (default 0)
+#        --processes=N          the number of --shard processes started at once, and of
+#                               --jobs workers (default 4)
+#        --chains=N             the number of :n3d chains they share (default 12)
+#        --workdir=<abspath>    the directory the logs and reports are written under
+#                               (default a new temporary directory, removed afterwards)
+#
+#    FindLogMarkers is compared with a str.find search of each of LogMarkers
+#    in turn, which finds every occurrence, overlapping ones too, on texts
+#    made of markers, markers that overlap, pieces of markers that run into
+#    each other and noise, searched between random bounds in blocks of a few
+#    bytes, so that markers cross the block edges. The find and rfind of an
+#    IndexedLog of each text are compared with those of its mmap, between
+#    random bounds. FindCapillary's capillaryWasFoundAutomatically is
+#    compared with a search of every pair of absY values, on lists with
+#    values close to 50 and 70 apart, NaN and infinite values, and values
+#    so large that their differences round.
+#    The --shard check writes a day of logs with genUcmLogs.py and reports
+#    it once with a single process, and then with several --shard processes
+#    started at once on another report directory. Between them they must
+#    print as many reports as the single process did, and write the same
+#    pdf files, with every chain in the manifest, so no chain was reported
+#    twice or left out. The --summarysize check reports the logs again with
+#    --jobs workers that share a new summaries.db, which must end up with
+#    one running total in summaryTotal, the bytes of the summaries in it.
+#
+#    Each check is printed with the number of inputs, or reports, that
+#    differ, and the script exits with status 1 when there are any.
+
+import sys
+import os
+import json
+import mmap
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+
+from array import array
+from optparse import OptionParser
+
+import dailyInitReport
+import genUcmLogs
+
+# two markers run together where the end of one is the beginning of the
+# other, as in "spe specimencategory="
+OverlappingMarkers = [ first + second[ n : ] for first in dailyInitReport.LogMarkers
+	for second in dailyInitReport.LogMarkers
+	for n in range( 1, min( len( first ), len( second )))
+	if( first[ -n : ] == second[ : n ] ) ]
+
+# absY values the pairs are made of besides random ones
+SpecialAbsYValues = ( float( 'nan' ), float( 'inf' ), -float( 'inf' ), 0.0, 50.0, 70.0, 120.0, 1e-300, 1e308, -1e308 )
+
+def CheckCapillary( options, rng ):
+	failed = 0
+	for trial in range( options.trials ):
+		absyList = GetAbsYList( rng )
+		found = dailyInitReport.FindCapillary.capillaryWasFoundAutomatically.im_func( None, array( 'd', absyList ))
+		if( found != FindCapillaryPairs( list( absyList ))):
+			failed += 1
+			if( failed <= 5 ):
+				print "  capillary differs on", absyList
+	return failed
+
+def CheckLogFind( path, text, rng ):
+	# what an IndexedLog of text finds differently from its mmap, None
+	# when they find the same
+	with open( path, 'w' ) as f:
+		f.write( text )
+	log = dailyInitReport.IndexedLog( path )
+	try:
+		with open( path, 'r' ) as f:
+			mm = mmap.mmap( f.fileno( ), 0, access=mmap.ACCESS_READ )
+		try:
+			for marker in dailyInitReport.LogMarkers:
+				bounds = ( rng.randint( -len( text ) - 2, len( text ) + 2 ), rng.randint( -len( text ) - 2, len( text ) + 2 ))
+				for name in ( "find", "rfind" ):
+					for args in (( marker, ), ( marker, bounds[ 0 ] ), ( marker, ) + bounds ):
+						if( getattr( log, name )( *args ) != getattr( mm, name )( *args )):
+							return "%s%r differs on %r" % ( name, args, text )
+		finally:
+			mm.close( )
+	finally:
+		log.close( )
+	return None
+
+def CheckMarkers( options, rng ):
+	blockSize = dailyInitReport.LogMarkerBlockSize
+	fd, path = tempfile.mkstemp( prefix="checkInitReport" )
+	os.close( fd )
+	failed = 0
+	try:
+		for trial in range( options.trials ):
+			text = GetMarkerText( rng )
+			start = rng.randint( 0, len( text ))
+			end = rng.randint( start, len( text ))
+			dailyInitReport.LogMarkerBlockSize = rng.randint( 1, 64 )
+			found = dailyInitReport.FindLogMarkers( text, start, end )
+			difference = None
+			if( found != FindMarkers( text, start, end )):
+				difference = "markers differ on %r" % text[ start : end ]
+			elif( len( text ) > 0 ):
+				difference = CheckLogFind( path, text, rng )
+			if( difference != None ):
+				failed += 1
+				if( failed <= 5 ):
+					print "  %s in blocks of %d" % ( difference, dailyInitReport.LogMarkerBlockSize )
+	finally:
+		dailyInitReport.LogMarkerBlockSize = blockSize
+		os.unlink( path )
+	return failed
+
+def CheckShard( options, logdir, workdir, expected ):
+	failed = 0
+	reported = 0
+	for output, status in StartReports( logdir, workdir + "/shard", options.processes, [ "--shard" ]):
+		reported += CountReports( output )
+		if( status != 0 ):
+			print "  a --shard process exited with status", status
+			failed += 1
+
+	failed += abs( reported - expected )
+	for subdir in ( "by_date", "by_bcode" ):
+		failed += len( set( os.listdir( workdir + "/single/" + subdir )) ^ set( os.listdir( workdir + "/shard/" + subdir )))
+	with open( workdir + "/shard/manifest.json" ) as f:
+		recorded = json.load( f )
+	for fname in os.listdir( logdir ):
+		for head, entry in recorded.items( ):
+			if( logdir + "/" + fname in [ path for path, size, mtime, digest in entry[ "files" ]] ):
+				break
+		else:
+			print "  no chain of", fname, "in the manifest"
+			failed += 1
+	if( failed > 0 ):
+		print "  %d reports by %d --shard processes, %d by one process" % ( reported, options.processes, expected )
+	return failed
+
+def CheckSummaries( options, logdir, workdir, expected ):
+	output, status = StartReports( logdir, workdir + "/summaries", 1,
+		[ "--jobs=%d" % options.processes, "--summarysize=1" ])[ 0 ]
+	failed = abs( CountReports( output ) - expected )
+	if( status != 0 ):
+		print "  the --jobs process exited with status", status
+		failed += 1
+	connection = sqlite3.connect( workdir + "/summaries/summaries.db" )
+	try:
+		rows = connection.execute( "SELECT bytes FROM summaryTotal" ).fetchall( )
+		total = connection.execute( "SELECT COALESCE( SUM( bytes ), 0 ) FROM summaries" ).fetchone( )[ 0 ]
+	finally:
+		connection.close( )
+	if( rows != [( total, )] ):
+		print "  summaryTotal holds", rows, "for summaries of", total, "bytes"
+		failed += 1
+	return failed
+
+def CountReports( output ):
+	return output.splitlines( ).count( dailyInitReport.ReportTitle )
+
+def FindCapillaryPairs( absyList ):
+	# the pairwise search capillaryWasFoundAutomatically replaced
+	if( len( absyList ) < 2 ):
+		return False
+
+	while( len( absyList ) > 1 ):
+		absyValue = absyList.pop()
+		for absy in absyList:
+			absyDiff = abs( absyValue - absy )
+			if(( absyDiff > 50.0 ) and ( absyDiff < 70.0 )):
+				return True
+	return False
+
+def FindMarkers( text, start, end ):
+	# the ( offset, slot ) of every occurrence of each marker, the way
+	# mmap.find finds them, in text order
+	found = []
+	for slot, marker in enumerate( dailyInitReport.LogMarkers ):
+		index = text.find( marker, start, end )
+		while( index != -1 ):
+			found.append(( index, slot ))
+			index = text.find( marker, index + 1, end )
+	return sorted( found )
+
+def GetAbsYList( rng ):
+	if( rng.random( ) < 0.2 ):
+		# values of about 1e16, only a few multiples of 2 apart
+		base = rng.choice(( 1e15, 1e16, -2e16, 3e16, 1e17 ))
+		return [ base + rng.randint( -20, 20 ) * rng.choice(( 2.0, 4.0, 8.0, 16.0 )) for i in range( rng.randint( 2, 7 ))]
+
+	absyList = []
+	for i in range( rng.randint( 0, 8 )):
+		choice = rng.random( )
+		if( choice < 0.2 ):
+			absyList.append( rng.choice( SpecialAbsYValues ))
+		elif( choice < 0.5 ):
+			absyList.append( rng.randint( -5, 5 ) * 10.0 + rng.choice(( 0.0, 50.0, 70.0, -50.0, -70.0 )))
+		elif( choice < 0.6 ):
+			absyList.append( rng.choice(( 50.0, 70.0 )) + rng.choice(( 1, -1 )) * rng.random( ) * 1e-13 )
+		else:
+			absyList.append( rng.uniform( -200.0, 200.0 ))
+	return absyList
+
+def GetMarkerText( rng ):
+	# markers, markers that overlap, their beginnings and ends, which run
+	# into the markers next to them, and noise of the characters the
+	# markers are made of
+	markers = dailyInitReport.LogMarkers
+	alphabet = "".join( set( "".join( markers ))) + "\n"
+	pieces = []
+	for i in range( rng.randint( 0, 12 )):
+		choice = rng.random( )
+		marker = rng.choice( markers )
+		if( choice < 0.3 ):
+			pieces.append( marker )
+		elif( choice < 0.4 ):
+			pieces.append( rng.choice( OverlappingMarkers ))
+		elif( choice < 0.6 ):
+			pieces.append( marker[ : rng.randint( 1, len( marker ))] )
+		elif( choice < 0.8 ):
+			pieces.append( marker[ rng.randint( 0, len( marker ) - 1 ) : ] )
+		else:
+			pieces.append( "".join( rng.choice( alphabet ) for j in range( rng.randint( 1, 8 ))))
+	return "".join( pieces )
+
+def RunChecks( options ):
+	rng = random.Random( options.seed )
+	failures = 0
+	for name, check in (( "FindLogMarkers", CheckMarkers ), ( "capillaryWasFoundAutomatically", CheckCapillary )):
+		failed = check( options, rng )
+		print "%-32s %d of %d inputs differ" % ( name, failed, options.trials )
+		failures += failed
+
+	# the processes of the other checks report the same day of logs,
+	# and are compared with a single process without options
+	workdir = options.workdir
+	if( workdir == None ):
+		workdir = tempfile.mkdtemp( prefix="checkInitReport" )
+	try:
+		logdir = workdir + "/logs"
+		if( os.path.isdir( logdir )):
+			shutil.rmtree( logdir )
+		(genOptions, args) = genUcmLogs.GetOptionParser( ).parse_args([
+			"--logdir=" + logdir, "--size=64", "--chains=%d" % options.chains, "--seed=%d" % options.seed ])
+		genUcmLogs.WriteLogDir( genOptions )
+
+		single, status = StartReports( logdir, workdir + "/single", 1, [] )[ 0 ]
+		reports = CountReports( single )
+		for name, check in (( "--shard (%d processes)" % options.processes, CheckShard ),
+			( "--summarysize (%d jobs)" % options.processes, CheckSummaries )):
+			failed = check( options, logdir, workdir, reports )
+			print "%-32s %d of %d reports differ" % ( name, failed, reports )
+			failures += failed
+	finally:
+		if( options.workdir == None ):
+			shutil.rmtree( workdir )
+	return failures
+
+def StartReports( logdir, rptdir, processes, args ):
+	# the ( stdout, exit status ) of each of processes dailyInitReport.py
+	# runs started at once on logdir, all of them writing to rptdir
+	if( os.path.isdir( rptdir )):
+		shutil.rmtree( rptdir )
+	for subdir in ( "by_date", "by_bcode" ):
+		os.makedirs( rptdir + "/" + subdir )
+	command = [ sys.executable, os.path.dirname( os.path.abspath( __file__ )) + "/dailyInitReport.py",
+		"--instr=cct032", "--logdir=" + logdir, "--rptdir=" + rptdir ] + args
+	started = [ subprocess.Popen( command, stdout=subprocess.PIPE ) for i in range( processes )]
+	return [( process.communicate( )[ 0 ], process.wait( )) for process in started ]
+
+if __name__ == '__main__':
+	parser = OptionParser()
+	parser.add_option( "--trials", dest="trials", type="int", default=2000, help="random inputs per check" )
+	parser.add_option( "--seed", dest="seed", type="int", default=0, help="random seed" )
+	parser.add_option( "--processes", dest="processes", type="int", default=4, help="number of --shard processes" )
+	parser.add_option( "--chains", dest="chains", type="int", default=12, help="number of n3d chains" )
+	parser.add_option( "-w", "--workdir", dest="workdir", help="work directory" )
+	(options, args) = parser.parse_args()
+	if( RunChecks( options ) > 0 ):
+		sys.exit( 1 )
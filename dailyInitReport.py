@@ -9,48 +9,440 @@
 #        --instr=cctXXX         the cell ct hostname (currently cct032 and cct034)
 #        --logdir=<abspath>     the absolute path to the root of the log file directory
 #        --rptdir=<abspath>     the absolute path to the root of the report directory
+#        --jobs=N               process the log files with a pool of N worker processes
+#        --force                reprocess log files the manifest records as unchanged
+#        --format=pdf|json|csv  write pdf reports (default), or print one JSON line or
+#                               CSV row per report to stdout without drawing anything
+#        --maxmapped=N          keep at most N log files open and mapped (default 16)
+#        --mapsize=MB           read log files larger than MB megabytes in blocks instead
+#                               of mapping them (default no limit)
+#        --profile              time the stages of every report and print a JSON record
+#                               per log file and a summary table to stderr
+#        --stagedir=<abspath>   copy the log files to this local directory before reading them
+#        --stagesize=MB         keep at most MB megabytes of log files in stagedir (default 4096)
+#        --summarysize=MB       keep up to MB megabytes of log summaries in rptdir/summaries.db
+#                               (default 0, no summaries)
+#        --query                list the runs recorded in rptdir/reports.db instead of
+#                               reading any logs, narrowed down by the options below
+#        --barcode=BCxxxxx      only the runs of this barcode
+#        --failed               only the runs that failed
+#        --from=mm/dd/yyyy      only the runs on or after this date
+#        --to=mm/dd/yyyy        only the runs on or before this date
+#        --backfill=mm/dd/yyyy-mm/dd/yyyy
+#                               report every day of this range for every instrument of
+#                               --instr, which may then be a comma separated list
+#        --logroot=<abspath>    the root of the instrument directories the default log and
+#                               report directories are under (default /mnt/lancer/upload/
+#                               DailyInstrumentData)
+#        --checkpoint=<path>    the file a backfill records its finished days in (default
+#                               ~/.dailyInitReport_backfill.json)
+#        --logtree=<abspath>    the ucm_logs tree a chain is looked for in when it goes on in
+#                               another day's log directory (default logroot/<instr>/gservlog/
+#                               ucm_logs, or none when --logdir is given)
+#        --follow               keep watching the log directory, of today unless --logdir
+#                               or --logdate is given, and report each run as it ends
+#        --interval=S           look at every followed log file at least every S seconds
+#                               (default 5)
+#        --poll                 only look every --interval seconds, without inotify
+#        --pipeline=N           read the log files up to N chains ahead of the ones being
+#                               evaluated, and write the pdf reports on a thread of their
+#                               own (default 0, each step in turn)
+#        --serve=<path>|PORT    answer report requests over HTTP on this Unix socket, or on
+#                               this port of localhost, until interrupted
+#        --shard                claim each chain through a lease file in rptdir/leases, so
+#                               several processes or hosts can report the same days at once
+#        --leasetime=S          take over a lease that was not renewed for S seconds
+#                               (default 300)
 #                               
 #    The results are stored as a pdf file in the location specified under rptdir in 
 #    a subdirectory named by_date. There is an additional subdirectory under rptdir
 #    named by_bcode with a hard link to the pdf file in the by_date subdirectory. 
 #    This provides two separate filesystem entities that sort by date and by barcode
 #    in the subdirectories by_date and by_bcode respectively. 
+#
+#    Every :USER: Start, Restart or Run entry in a log file begins a run, and
+#    each run gets its own report, evaluated only from the log up to where the
+#    next run starts. The last run in a log file keeps the historical report
+#    name, the runs before it have _r<N> (N counts the runs in the file from
+#    1) added after the barcode in both names.
+#
+#    A manifest (rptdir/manifest.json) records the size, mtime and content hash
+#    of every log file in each processed :n3d chain along with the reports that
+#    were written for it. Chains that have not changed since they were recorded
+#    are skipped on later runs. The json and csv formats write no files and
+#    evaluate every log file.
+#
+#    With --profile, each log file's record has the seconds spent in each stage
+#    (indexing, chain following, the stage classes, time stamps, pdf and link),
+#    the bytes of log scanned, the log files opened and the deepest chain a run
+#    of it followed. Without it the stages are not timed at all. With a
+#    --pipeline writer thread, the records are printed once it has written the
+#    reports, so the pdf and link time is in the record of each report's log.
+#
+#    Log files compressed with gzip (.log.gz) or zstd (.log.zst, when the zstandard
+#    module is installed) are read as a stream, and only their lines holding one
+#    of the entries the report looks for are kept. A :n3d entry that names a log
+#    resolves to whichever of name.log, name.log.gz and name.log.zst exists. The
+#    successor of each compressed log is recorded in rptdir/logtails.json, so
+#    later runs find the chains without decompressing unchanged files again.
+#    The compressed logs a --jobs parent decompresses to find the chains are
+#    handed to the workers with their chains, as the summaries of their
+#    marker lines, and are not decompressed a second time.
+#    With --mapsize, an uncompressed log file larger than the limit is read the
+#    same way, a block at a time, instead of being mapped whole, as is any log
+#    file there is not enough address space left to map. Such a log takes the
+#    memory of one block and its marker lines, whatever its size.
+#
+#    With --stagedir, each log file is copied from the log directory with large
+#    sequential reads into stagedir and read from there. The files of a chain
+#    after its head, and the head of the next chain, are copied by background
+#    threads while the file before them is scanned. A copy is named for the
+#    size and mtime of its log file, so a log that changes is copied again, and
+#    the least recently used copies are removed beyond --stagesize. Files of
+#    stagedir that are not named like a copy are never counted or removed.
+#
+#    Every run that gets a pdf report, or fails to, is also recorded in the
+#    reports table of rptdir/reports.db, the rows of a log directory are written
+#    in one transaction at the end. With --query the matching runs are printed
+#    as JSON lines or CSV rows with --format=json|csv, and as the paths of their
+#    pdf files otherwise, for the instrument given with --instr.
+#
+#    A :n3d entry that names no log in the directory of its own log, as at
+#    midnight or the end of a month, is looked up in an index of every log
+#    file under --logtree by name, kept in rptdir/lognames.json with the
+#    mtime and contents of each directory of the tree. When a name is not
+#    in the index, the directories whose mtime changed since are listed
+#    again, at most every few seconds, the others are not, so a backfill
+#    follows its chains from one day or month into the next without walking
+#    the tree again. The directories --jobs workers list are handed back to
+#    the parent process with their reports, and saved by it.
+#
+#    The number of run start entries found in each log file is recorded, with
+#    its size and mtime, in rptdir/logruns.json. A log recorded with none is not
+#    read again to look for runs while it is unchanged, only when a run that
+#    started in another log continues into it.
+#
+#    With --pipeline, a reader thread reads the log files of the chains, in
+#    order, while the chains before them are evaluated, so they are in the
+#    page cache, or copied to --stagedir, by the time they are indexed. It
+#    waits while it is N chains ahead of the ones being evaluated, by this
+#    process or its workers, and logs that have a summary are not read. The
+#    pdf reports of a process without workers are rendered, written and
+#    linked on a writer thread, at most 16 of them waiting, while the next
+#    runs are evaluated. An interrupted run stops the reader and waits for
+#    the reports handed to the writer before it exits, so every report the
+#    manifest records is written.
+#
+#    With --serve the process stays up and answers GET requests with JSON,
+#    one at a time, keeping the logs it indexed, the chains it planned and
+#    the pdf template from one request to the next:
+#
+#        /report?barcode=BCxxxxx     evaluate the runs reports.db records for the
+#                                    barcode again, and write their pdf reports
+#        /report?log=<name>[&date=mm/dd/yyyy]
+#                                    the same for every run of a log file, of the
+#                                    log directory of date (default that of the
+#                                    options), or at the absolute path given
+#        /day[?date=mm/dd/yyyy]      the log files and chains of a day's log
+#                                    directory, how many chains the manifest has
+#                                    as current, and the runs recorded for it
+#        /health                     the requests answered so far by endpoint,
+#                                    those of any other path as other, their
+#                                    errors and times, and the logs held indexed
+#
+#    e.g. curl --unix-socket /tmp/initreport.sock http://localhost/report?barcode=BC00042
+#    A log that changed since it was indexed is indexed again, and a log
+#    directory is planned again when any file in it changed. With --format
+#    json or csv the runs are evaluated without writing any pdf. A request
+#    with a date is refused when --logdir is given, the days' directories
+#    are only known under --logroot. The path of --serve is only replaced
+#    when it is a socket no server answers on.
+#
+#    Every file under rptdir is written under a name of its own to the host,
+#    process and thread and renamed into place, so a report or index that
+#    exists is always complete. The manifest and the JSON indexes (logtails,
+#    logruns and lognames) are saved over whatever entries other processes
+#    saved since they were read.
+#
+#    With --shard, a chain is only reported by the process that creates its
+#    lease file (rptdir/leases/<hash>_<head>.lease) with O_EXCL. The lease is
+#    renewed, by touching it, every quarter of --leasetime while it is held,
+#    and removed once the chain is saved in the manifest, which is saved
+#    under a lease of its own. A process that claims a chain reads its entry
+#    again and skips it when another process reported it meanwhile. A lease
+#    not renewed for --leasetime seconds, left by a process that died, is
+#    taken over. The lease file names the process that holds it, one whose
+#    lease was taken over stops renewing it and leaves the chain out of the
+#    manifest it saves. Each host runs the same command (a day, or a
+#    --backfill, with the same --rptdir) and the chains are shared out
+#    between them.
+#
+#    With --summarysize, the marker index of each log file that is read, and
+#    the lines its markers are on, are kept in rptdir/summaries.db with the size
+#    and mtime of the log. A log that has not changed since is opened from its
+#    summary on later runs, by any worker, without reading any of the log, the
+#    way a compressed log is read. The least recently used summaries are
+#    removed beyond --summarysize.
+#
+#    A backfill reports the days of each instrument one after the other in one
+#    process, each day like a run of its own with the same options, and prints
+#    its progress and a final summary to stderr. Each day that is done is saved
+#    in the checkpoint file at once, an interrupted backfill started again with
+#    the same options skips the days it finished, unless --force is given.
+#
+#    With --follow the log files are indexed as they are written, each time
+#    only the lines added since they were last looked at are scanned. A run is
+#    reported as soon as it reaches data collection (:pse), a :USER: Stop or
+#    the fifteen minute timeout, or the next run starts. Changes are waited
+#    for with inotify where libc has it, and every file is also looked at
+#    after each --interval, which is all --poll does. A run reported as the
+#    last one in its log file gets its _r<N> name when another run starts in
+#    the same file, so the reports end up named as the daily run names them.
+#    A followed run is evaluated from the log written up to when it is reported,
+#    while the daily run also sees the entries after its end up to the next run.
+#    Followed chains are not recorded in the manifest, the daily run reports
+#    them again under the same names. The follow runs until it is interrupted,
+#    and moves on to the next day's directory at midnight unless --logdir or
+#    --logdate is given.
+#
+#    The pdf files are single page text reports written directly by
+#    PdfReportTemplate, which places each line where matplotlib's
+#    fig.text( x, y, ..., ha='left', va='top' ) put it on the 8.5x11 page.
 
 import string
 import sys
 import mmap
 import os
+import re
 import contextlib
+import copy
+import errno
+import ctypes
+import ctypes.util
+import csv
+import hashlib
+import heapq
+import json
+import marshal
+import math
+import select
+import socket
+import shutil
+import signal
+import sqlite3
+import stat
+import struct
+import threading
 import time
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as pyplot
-
+import traceback
+import zlib
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from cStringIO import StringIO
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 from datetime import date, timedelta
+from multiprocessing import Pool
+from Queue import Queue, Empty, Full
 from optparse import OptionParser
+from SocketServer import TCPServer
+from urlparse import parse_qs, urlparse
+
+# .log.zst files can only be read when the zstandard module is installed
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+# --follow waits for the log files to change with inotify where libc
+# has it, and only polls them otherwise
+try:
+	libc = ctypes.CDLL( ctypes.util.find_library( 'c' ), use_errno=True )
+	libc.inotify_init
+	libc.inotify_add_watch
+	libc.inotify_rm_watch
+except ( OSError, AttributeError ):
+	libc = None
+
+# created on first use by GetPdfTemplate, only pdf reports need it
+pdfTemplate = None
+
+# created on first use by GetLogResolver
+logResolver = None
+
+# created on first use by GetRunProfile
+runProfile = None
+
+# created on first use by GetLogStage, when --stagedir is given
+logStage = None
+
+# created on first use by GetReportIndex
+reportIndex = None
+
+# created on first use by GetLogRunIndex
+logRunIndex = None
+
+# created on first use by GetLogSummaryCache, when --summarysize is given
+logSummaryCache = None
+
+# created on first use by GetLogNameIndex, when there is a log tree
+logNameIndex = None
+
+# set by ProcessLogChains while --pipeline writes the pdf reports on a
+# thread of their own
+reportWriter = None
+
+# created on first use by GetWorkerPool, when --jobs is more than 1, a
+# backfill keeps it for all of its days
+workerPool = None
+
+# the log directory a pool worker last processed a chain of
+workerLogDir = None
 
 NumericMonth = { 
 	"Jan":"01", "Feb":"02", "Mar":"03", "Apr":"04", "May":"05", "Jun":"06",
 	"Jul":"07", "Aug":"08", "Sep":"09", "Oct":"10", "Nov":"11", "Dec":"12" }
 
+# Every marker the stage classes search for. Each log file is walked once
+# by FindLogMarkers, and the resulting marker index answers the find/rfind
+# calls made for them afterwards. Every occurrence of each marker is
+# indexed, also one that overlaps another marker (as "spe specimen" and
+# "specimencategory=" do), so the index answers as mmap's find would.
+LogMarkers = (
+	":USER: Start", ":USER: Restart", ":USER: Run", ":USER: Stop",
+	":USER: Coarse Focus Control  RESET", "Fifteen minute",
+	"spe specimen", "specimencategory=", "disposable=",
+	":cap is", "absY=[", ":cal success", "Pressure/PumpPos Slope",
+	"mode=capcal", "status=success", ":pse ", ":n3d " )
+
+# the entries that begin a run, and the ones a followed run is reported
+# at, short of the start of the next run
+RunStartMarkers = ( ":USER: Start", ":USER: Restart", ":USER: Run" )
+RunEndMarkers = ( ":pse ", ":USER: Stop", "Fifteen minute" )
+
+# the markers are searched for in blocks of this many bytes, each block is
+# read with the bytes a marker starting in it can run on into the next
+LogMarkerBlockSize = 1024 * 1024
+LogMarkerOverlap = max( len( marker ) for marker in LogMarkers ) - 1
+
+ReportTitle = "VisionGate CCT QC Report"
+
+# The report page and font, in points. The ascent and descent are the DejaVu
+# Sans metrics matplotlib used to lay out the 10 point report text, a line
+# of text is placed ReportFontAscent below its top, and the lines of a
+# multi-line string are ReportFontDescent + 1.2 * ReportFontAscent apart.
+ReportPageWidth = 612
+ReportPageHeight = 792
+ReportFontSize = 10
+ReportFontAscent = ReportFontSize * 1556 / 2048.0
+ReportFontDescent = ReportFontSize * 426 / 2048.0
+ReportLineStep = ReportFontDescent + 1.2 * ReportFontAscent
+
+# columns of --format=csv, the same keys name the fields of a --format=json line
+ReportFields = (
+	"log", "run", "instrument", "barcode", "category", "rundate", "runtime",
+	"findCapillary", "illuminationCalibration", "cameraCalibration",
+	"pressureVelocityTest", "capillaryCalibration", "dataCollection",
+	"ccode", "error" )
+
+# the columns of the reports table of rptdir/reports.db, its rundate
+# is yyyy-mm-dd so that dates sort and compare as strings
+ReportIndexColumns = ( "logpath", ) + ReportFields + ( "pdf", )
+
+# log lines are indexed in blocks of this many bytes, only the blocks
+# holding a line that a time stamp is read from are ever indexed
+LineIndexBlockSize = 64 * 1024
+
+NewlinePattern = re.compile( "\n" )
+
+# :n3d is the last entry the ucm writes before it rolls over to the next log
+# file, so it is looked for in this many bytes at the end of the file when
+# the chain is walked without mapping the logs
+LogTailSize = 64 * 1024
+
+# the names a log file can have, the logs that are not mapped, like the
+# compressed ones, are read or decompressed in blocks of LogBlockSize bytes
+LogSuffixes = ( ".log", ".log.gz", ".log.zst" )
+LogBlockSize = 1024 * 1024
+
+# the names the ucm gives its log files, <instr>_yyyymmdd_hhmmss.log, only
+# files named so are followed
+LogFnamePattern = re.compile( r"[^_/]+_[0-9]{8}_[0-9]{6}\.log(\.gz|\.zst)?$" )
+
+# a name that is not in the log tree index has the tree looked at again,
+# at most this often (seconds)
+LogNameRefresh = 5.0
+
+# log files are copied to the stage directory in reads of StageCopySize
+# bytes, by StageThreads threads when they are copied ahead of use
+StageCopySize = 4 * 1024 * 1024
+StageThreads = 2
+
+# the names LogStage gives its copies, <digest>_<size>_<mtime>_<name>, only
+# files named so are counted against --stagesize and ever removed
+StageCopyPattern = re.compile( r"[0-9a-f]{16}_[0-9]+_[0-9]+_.+$" )
+
+# --pipeline hands at most this many pdf reports to the writer thread
+# before the runs after them wait for it
+ReportQueueSize = 16
+
+# --shard leases, the lease that guards the manifest, and how long a
+# process waits between attempts to take it
+LeaseDirName = "leases"
+ManifestLeaseName = "manifest.lease"
+LeaseWait = 0.05
+
+# --serve starts over with a new resolver once it holds this many logs,
+# so a service that is asked about many days does not keep them all
+ServeMaxLogs = 4096
+
+# the inotify events that tell a followed log directory changed, the
+# header every event begins with, and the event of a lost queue
+InotifyMask = 0x00000002 | 0x00000008 | 0x00000080 | 0x00000100
+InotifyEventHeader = struct.Struct( "iIII" )
+InotifyOverflow = 0x00004000
+
+class BackfillCheckpoint:
+	def __init__( self, path ):
+		# the days of a backfill, by instrument and date, with how they went
+		self._path = path
+		self._entries = LoadJson( path )
+
+	def IsDone( self, unit ):
+		# a day is done when it was reported into the same report
+		# directory in the same format
+		entry = self._entries.get( unit.GetUnitName( ))
+		return (( entry != None ) and ( entry[ 'status' ] == 'done' ) and
+			( entry[ 'rptdir' ] == unit.RptDir( )) and ( entry[ 'format' ] == unit.Format( )))
+
+	def Record( self, unit, status, chains, seconds ):
+		self._entries[ unit.GetUnitName( )] = { 'status': status, 'chains': chains,
+			'seconds': seconds, 'rptdir': unit.RptDir( ), 'format': unit.Format( ) }
+		self.Save( )
+
+	def Save( self ):
+		SaveJson( self._path, self._entries )
+
 class BarcodeData:
-	def __init__( self, mm, tagIndex ): 
+	def __init__( self, window, mm, tagIndex ): 
 		categoryKeyword = "specimencategory="
 		disposableKeyword = "disposable="
+		end = window.End( mm )
 
 		# get the index to the log entry containing "spe specimen"
-		speIndex = mm.find( "spe specimen", tagIndex )
+		speIndex = mm.find( "spe specimen", tagIndex, end )
 		if( speIndex == -1 ):
 			raise ValueError( "Can't locate specimen log entry" )
 	
-		keywordIndex = mm.find( categoryKeyword, mm.find( "\n", speIndex ))
+		keywordIndex = mm.find( categoryKeyword, mm.find( "\n", speIndex ), end )
 		if( keywordIndex == -1 ):
 			raise ValueError( "Can't determine specimen type" )
 
 		categoryIndex = keywordIndex + len( categoryKeyword )
 		self._category = mm[ categoryIndex : mm.find (" ", categoryIndex )]
 
-		keywordIndex = mm.find( disposableKeyword, mm.find( "\n", speIndex ))
+		keywordIndex = mm.find( disposableKeyword, mm.find( "\n", speIndex ), end )
 		if( keywordIndex == -1 ):
 			raise ValueError( "Can't locate barcode" )
 
@@ -59,14 +451,14 @@ class BarcodeData:
 		self._dtStamp = DateTimeStamp( mm, bcodeIndex ) 
 
 	def GetReport( self ):
-		rptString = "Barcode(" + self._barcode + "), Specimen type(" + self._category + "), " + self._dtStamp._rundate + " " + self._dtStamp._runtime
+		rptString = "Barcode(" + self._barcode + "), Specimen type(" + self._category + "), " + self._dtStamp.GetStamp( )
 		return rptString
 
 	def Barcode( self ):
 		return self._barcode
 
 class CapillaryCalibration:
-	def __init__( self, config, mm, startIndex ):
+	def __init__( self, window, mm, startIndex ):
 		capcalString = "mode=capcal"
 		successString = "status=success"
 		fifteenMinString = "Fifteen minute"
@@ -75,15 +467,16 @@ class CapillaryCalibration:
 		self._mm = mm
 		self._index = startIndex
 		self._capillaryCalibrationPassed = False
-		self._config = config
+		self._window = window
 
-		userStopIndex = mm.find( userStopString, startIndex )
-		fifteenMinIndex = mm.find( fifteenMinString, startIndex )
+		end = window.End( mm )
+		userStopIndex = mm.find( userStopString, startIndex, end )
+		fifteenMinIndex = mm.find( fifteenMinString, startIndex, end )
 		index = startIndex
 
 		while( True ):
 
-			capcalIndex = mm.find( capcalString, index )
+			capcalIndex = mm.find( capcalString, index, end )
 			if( capcalIndex != -1 ):
 
 				# there's a capcalString ("mode=capcal") in the file
@@ -126,7 +519,7 @@ class CapillaryCalibration:
 					resultIndex = capcalIndex + len( capcalString )
 
 					# see if the capillary calibration succeeded in this log file
-					successIndex = mm.find( successString, index )
+					successIndex = mm.find( successString, index, end )
 					if( successIndex != -1 ):
 						# capillary calibration succeeded
 						self._dtStamp = DateTimeStamp( mm, successIndex ) 
@@ -162,8 +555,8 @@ class CapillaryCalibration:
 			# fifteen minute time out in the file, get 
 			# the next file... if there is a next file
 
-			nextFileName = self.GetNextFilename( mm )
-			if( nextFileName == "" ):
+			nextLog = self._window.Next( mm )
+			if( nextLog == None ):
 
 				# there is no n3d entry in the log file,
 				# the ucm must have stopped suddenly
@@ -172,29 +565,14 @@ class CapillaryCalibration:
 				self._capillaryCalibrationPassed = False
 				return
 
-			# open the next log file, and map it
-			try:
-				f = open( nextFileName, 'r' )
-			except IOError as detail:
-				filenotfound = 'file not found:' + os.path.basename(nextFileName)
-				raise ValueError(filenotfound)
-			
-			mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+			# continue in the next log file
+			mm = nextLog
 			self._mm = mm
 
 			index = 0
-			userStopIndex = mm.find( userStopString, 0 )
-			fifteenMinIndex = mm.find( fifteenMinString, 0 )
-
-	def GetNextFilename( self, mm ):
-		n3dSearchStr = ":n3d "
-
-		nextFileNameIndex = mm.rfind( n3dSearchStr )
-		if( nextFileNameIndex == -1 ):
-			return ""
-
-		nextFileName = mm[ nextFileNameIndex + len( n3dSearchStr ) : mm.find( "\n", nextFileNameIndex )].strip()
-		return self._config.LogDir( ) + '/' + nextFileName + '.log'
+			end = self._window.End( mm )
+			userStopIndex = mm.find( userStopString, 0, end )
+			fifteenMinIndex = mm.find( fifteenMinString, 0, end )
 
 	def GetMMap( self ):
 		return self._mm
@@ -205,13 +583,13 @@ class CapillaryCalibration:
 	def GetReport( self ):
 		rptString = ""
 		if( self._capillaryCalibrationPassed == True ):
-			rptString = "(pass)  Capillary Calibration " + self._dtStamp._rundate + " " + self._dtStamp._runtime
+			rptString = "(pass)  Capillary Calibration " + self._dtStamp.GetStamp( )
 		else:
 			rptString = "(fail)  Capillary Calibration"
 		return rptString
 
 class DataCollection:
-	def __init__( self, config, mm, startIndex ):
+	def __init__( self, window, mm, startIndex ):
 
 		pseString= ":pse "
 		fifteenMinString = "Fifteen minute"
@@ -220,15 +598,16 @@ class DataCollection:
 		self._mm = mm
 		self._index = startIndex
 		self._dataCollectionStarted = False
-		self._config = config
+		self._window = window
 
-		userStopIndex = mm.find( userStopString, startIndex )
-		fifteenMinIndex = mm.find( fifteenMinString, startIndex )
+		end = window.End( mm )
+		userStopIndex = mm.find( userStopString, startIndex, end )
+		fifteenMinIndex = mm.find( fifteenMinString, startIndex, end )
 		index = startIndex 
 
 		while( True ):
 
-			pseIndex = mm.find( pseString, index )
+			pseIndex = mm.find( pseString, index, end )
 			if( pseIndex != -1 ):
 
 				# data collection string found
@@ -282,8 +661,8 @@ class DataCollection:
 				self._dataCollectionStarted = False
 				return
 
-			nextFileName = self.GetNextFilename( mm )
-			if( nextFileName == "" ):
+			nextLog = self._window.Next( mm )
+			if( nextLog == None ):
 
 				# there is no n3d entry in the log file
 				# the ucm must have stopped suddenly
@@ -292,29 +671,14 @@ class DataCollection:
 				self._pressureVelocityTestPassed = False
 				return
 
-			# open the next log file, and map it
-			try:
-				f = open( nextFileName, 'r' ) 
-			except IOError as detail:
-				filenotfound = 'file not found:' + os.path.basename(nextFileName)
-				raise IOError(filenotfound)
-	
-			mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+			# continue in the next log file
+			mm = nextLog
 			self._mm = mm
 
 			index = 0
-			userStopIndex = mm.find( userStopString, 0 )
-			fifteenMinIndex = mm.find( fifteenMinString, 0 )
-
-	def GetNextFilename( self, mm ):
-		n3dSearchStr = ":n3d "
-
-		nextFileNameIndex = mm.rfind( n3dSearchStr )
-		if( nextFileNameIndex == -1 ):
-			return ""
-
-		nextFileName = mm[ nextFileNameIndex + len( n3dSearchStr ) : mm.find( "\n", nextFileNameIndex )].strip()
-		return self._config.LogDir( ) + '/' + nextFileName + '.log'
+			end = self._window.End( mm )
+			userStopIndex = mm.find( userStopString, 0, end )
+			fifteenMinIndex = mm.find( fifteenMinString, 0, end )
 
 	def GetMMap( self ):
 		return self._mm
@@ -322,43 +686,49 @@ class DataCollection:
 	def GetReport( self ):
 		rptString = ""
 		if( self._dataCollectionStarted == True ):
-			rptString = "(pass)  Data Collection Initiated " + self._dtStamp._rundate + " " + self._dtStamp._runtime
+			rptString = "(pass)  Data Collection Initiated " + self._dtStamp.GetStamp( )
 		else:
-			rptString  = "(fail)  Data Collection Aborted" # + self._dtStamp._rundate + " " + self._dtStamp._runtime
+			rptString  = "(fail)  Data Collection Aborted" # + self._dtStamp.GetStamp( )
 		return rptString
 
 class DateTimeStamp:
 	def __init__( self, mm = None, index = 0 ):
-		if(( mm == None ) and ( index == 0 )):
-			self._rundate = ""
-			self._runtime = ""
-			return 
+		# only remember where the stamp is, the log line is parsed the
+		# first time the stamp is rendered into a report string
+		self._mm = mm
+		self._index = index
+		self._stamp = None
 
-		# get the index to the beginning of the line 
-		lineIndex = mm.rfind( "\n", 0, index )
-		if( lineIndex == -1 ):
-			raise ValueError( "Can't locate beginning of the line" )
+	def GetDate( self ):
+		return self._GetStamp( )[ 0 ]
+
+	def GetStamp( self ):
+		rundate, runtime = self._GetStamp( )
+		return rundate + " " + runtime
 
-		# Break the line into words. The first two words are
-		# 3 letter month and 0 suppressed day. Change to mm/dd/yyyy.
-		lineField = mm[ lineIndex : index ].split()
-		reportYear = lineField[ 5 ][ 7:11 ]
-		self._rundate = NumericMonth[ lineField[ 0 ]] + "/" + lineField[ 1 ].zfill(2) + "/" + reportYear
+	def GetTime( self ):
+		return self._GetStamp( )[ 1 ]
 
-		# the next field is the time stamp of when the sample
-		# was processed. Just use the hh:mm:ss
-		self._runtime = lineField[ 2 ][ 0:8 ] 
+	def _GetStamp( self ):
+		if( self._stamp == None ):
+			if(( self._mm == None ) and ( self._index == 0 )):
+				self._stamp = ( "", "" )
+			else:
+				self._stamp = self._mm.GetLineStamp( self._index )
+		return self._stamp
 
 class FindCapillary:
-	def __init__( self, mm, tagIndex ):
+	def __init__( self, window, mm, tagIndex ):
 		manualFindString = ":USER: Coarse Focus Control  RESET" 
 		manualFindIndex = tagIndex
 		self._method = "automatic"
+		self._window = window
 
 		# get the index for all of the ":cap is" 
 		# values starting from the user-tag, and searching
-		# to the end of the file
-		absyList = self.getAbsYList( mm, tagIndex )
+		# to the end of the run in this file
+		end = window.End( mm )
+		absyList = self.getAbsYList( mm, tagIndex, end )
 
 		# if the difference between the values of any two entries 
 		# in the list is greater than 50 and less than 70, then 
@@ -369,7 +739,7 @@ class FindCapillary:
 
 		# the capillary was not found automatically, 
 		# see if it was found manually
-		manualFindIndex = mm.find( manualFindString, manualFindIndex )
+		manualFindIndex = mm.find( manualFindString, manualFindIndex, end )
 
 		while( True ):
 			if( manualFindIndex > -1 ):
@@ -380,83 +750,81 @@ class FindCapillary:
 
 			# manualFindString was not found in this file,
 			# get the next file... if there is a next file
-			nextFileName = self.GetNextFilename( mm )
-			if( nextFileName == "" ):
+			nextLog = self._window.Next( mm )
+			if( nextLog == None ):
 				# there is no n3d entry in the log file,
 				# the ucm must have stopped suddenly
 				self._dtStamp = DateTimeStamp( ) 
 				self._capillaryFound = False
 				return
 
-			# open the next log file, and map it
-			try:
-				f = open( nextFileName, 'r' )
-			except IOError as detail:
-				filenotfound = 'file not found:' + os.path.basename(nextFileName)
-				raise ValueError(filenotfound)
-			
-			mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+			# continue in the next log file
+			mm = nextLog
 			self._mm = mm
 
-			manualFindIndex = mm.find( manualFindString, 0 )
+			end = self._window.End( mm )
+			manualFindIndex = mm.find( manualFindString, 0, end )
 
 	def capillaryWasFoundAutomatically( self, absyList ):
+		# NaN and infinite values never differ from another value by
+		# a finite amount, so only the finite ones can pair up
+		absyList = array( 'd', sorted( absy for absy in absyList
+			if not ( math.isnan( absy ) or math.isinf( absy ))))
 		if( len( absyList ) < 2 ):
 			return False
 
-		while( len( absyList ) > 1 ):
-			absyValue = absyList.pop()
-			for absy in absyList:
-				absyDiff = abs( absyValue - absy )
-				if(( absyDiff > 50.0 ) and ( absyDiff < 70.0 )):
-					return True
+		# For each value, the values above it are in order of their
+		# difference from it (rounding keeps the subtraction monotonic),
+		# so only the first one that differs by more than 50 can differ
+		# by less than 70. Its position is found by bisection and then
+		# settled on the same subtraction the comparison uses.
+		for i, absy in enumerate( absyList ):
+			j = bisect_right( absyList, absy + 50.0, i + 1 )
+			while(( j > i + 1 ) and ( absyList[ j - 1 ] - absy > 50.0 )):
+				j -= 1
+			while(( j < len( absyList )) and ( absyList[ j ] - absy <= 50.0 )):
+				j += 1
+			if(( j < len( absyList )) and ( absyList[ j ] - absy < 70.0 )):
+				return True
 		return False
 		
-	def getAbsYList( self, mm, index ):
+	def getAbsYList( self, mm, index, end ):
 		absyString = "absY=["
 		capisString = ":cap is"
 
-		absyList = []	
-		absyIndex = mm.find( capisString, index )
+		absyValues = []
+		absyIndex = mm.find( capisString, index, end )
 
-		self._dtStamp = DateTimeStamp( mm, index ) 
+		# the report shows the time of the last absY entry
+		stampIndex = index
 		while( absyIndex != -1 ):
-			absyIndex = mm.find( absyString, absyIndex )
+			absyIndex = mm.find( absyString, absyIndex, end )
 			if( absyIndex == -1 ):
 				break
 
-			self._dtStamp = DateTimeStamp( mm, absyIndex ) 
+			stampIndex = absyIndex
 			if( mm[ absyIndex + len( absyString )] != "]" ):
 				lbracketIndex = absyIndex + len( absyString ) - 1
 				rbracketIndex = mm.find( "]", lbracketIndex )
 
-				tmpList = mm[ lbracketIndex + 1 : rbracketIndex ].split()
-				for absyValue in tmpList:
-					absyList.append( float( absyValue ))
+				absyValues.append( mm[ lbracketIndex + 1 : rbracketIndex ] )
+
+			absyIndex = mm.find( capisString, absyIndex, end )
 
-			absyIndex = mm.find( capisString, absyIndex )
-		return absyList
+		# the values of all the entries are split and converted in one go
+		self._dtStamp = DateTimeStamp( mm, stampIndex )
+		return array( 'd', map( float, " ".join( absyValues ).split( )))
 
 	def GetReport( self ):
 		rptString = ""
 		if( self._capillaryFound == True ):
-			rptString = "(pass)  Find Capillary (" + self._method + ") " + self._dtStamp._rundate + " " + self._dtStamp._runtime
+			rptString = "(pass)  Find Capillary (" + self._method + ") " + self._dtStamp.GetStamp( )
 		else:
-			rptString = "(fail)  Find Capillary " + self._dtStamp._rundate + " " + self._dtStamp._runtime
+			rptString = "(fail)  Find Capillary " + self._dtStamp.GetStamp( )
 		return rptString
 
-	def GetNextFilename( self, mm ):
-		n3dSearchStr = ":n3d "
-
-		nextFileNameIndex = mm.rfind( n3dSearchStr )
-		if( nextFileNameIndex == -1 ):
-			return ""
-
-		nextFileName = mm[ nextFileNameIndex + len( n3dSearchStr ) : mm.find( "\n", nextFileNameIndex )].strip()
-		return self._config.LogDir( ) + '/' + nextFileName + '.log'
-
 class IlluminationCameraCalibration:
-	def __init__( self, mm, tagIndex ):
+	def __init__( self, window, mm, tagIndex ):
 		illumCalString = ":cal success"
 		illumCalIndex = tagIndex
 
@@ -464,7 +832,7 @@ class IlluminationCameraCalibration:
 		self._cameraCalibrationPassed = False
 
 		# get the index to the log entry containing ":cal success"
-		illumCalIndex = mm.find( illumCalString, illumCalIndex )
+		illumCalIndex = mm.find( illumCalString, illumCalIndex, window.End( mm ))
 		if( illumCalIndex == -1 ):
 			self._dtStamp = DateTimeStamp( mm, tagIndex ) 
 			return
@@ -476,21 +844,1316 @@ class IlluminationCameraCalibration:
 	def GetIllumReport( self ):
 		rptString = ""
 		if(( self._illuminationCalibrationPassed == True ) and ( self._cameraCalibrationPassed )):
-			rptString = "(pass)  Illumination Calibration " + self._dtStamp._rundate + " " + self._dtStamp._runtime 
+			rptString = "(pass)  Illumination Calibration " + self._dtStamp.GetStamp( )
 		else:
-			rptString = "(fail)  Illumination Calibration " + self._dtStamp._rundate + " " + self._dtStamp._runtime
+			rptString = "(fail)  Illumination Calibration " + self._dtStamp.GetStamp( )
 		return rptString
 
 	def GetCameraReport( self ):
 		rptString = ""
 		if(( self._illuminationCalibrationPassed == True ) and ( self._cameraCalibrationPassed )):
-			rptString = "(pass)  Camera Calibration " + self._dtStamp._rundate + " " + self._dtStamp._runtime 
+			rptString = "(pass)  Camera Calibration " + self._dtStamp.GetStamp( )
 		else:
-			rptString = "(fail)  Camera Calibration " + self._dtStamp._rundate + " " + self._dtStamp._runtime 
+			rptString = "(fail)  Camera Calibration " + self._dtStamp.GetStamp( )
 		return rptString
 
+class InitReport:
+	def __init__( self, config, window, logFname, run, mm, userStartIndex ):
+		self._logFname = logFname
+		self._run = run
+		self._instr = config.GetInstr( )
+		self._header = ReportHeader( config.GetInstr( ))
+		self._barcodeData = None
+		self._findCapillary = None
+		self._illumCamCalib = None
+		self._pvTest = None
+		self._capCal = None
+		self._dataCol = None
+		self._error = None
+
+		# evaluate the stages in report order, a stage that can't be
+		# evaluated leaves it and the stages after it unset
+		profile = GetRunProfile( config )
+		try:
+			with profile.Stage( "BarcodeData" ):
+				self._barcodeData = BarcodeData( window, mm, userStartIndex )
+			with profile.Stage( "FindCapillary" ):
+				self._findCapillary = FindCapillary( window, mm, userStartIndex )
+			with profile.Stage( "IlluminationCameraCalibration" ):
+				self._illumCamCalib = IlluminationCameraCalibration( window, mm, userStartIndex )
+			with profile.Stage( "PressureVelocityTest" ):
+				self._pvTest = PressureVelocityTest( window, mm, userStartIndex )
+
+			# locating the capillary calibration status involves
+			# following some number of log files, which the
+			# resolver opens and maps at most once per run
+			with profile.Stage( "CapillaryCalibration" ):
+				self._capCal = CapillaryCalibration( window, self._pvTest.GetMMap(), self._pvTest.GetIndex())
+
+			# locating the data collection started information
+			# also involves following some number of log files
+			with profile.Stage( "DataCollection" ):
+				self._dataCol = DataCollection( window, self._capCal.GetMMap( ), self._capCal.GetIndex())
+
+		except ValueError as detail:
+			self._error = detail
+
+		# render the report lines now, the time stamps they show are
+		# parsed from the log here, and a stamp that can't be parsed
+		# ends the report like a stage that can't be evaluated
+		self._lines = []
+		try:
+			with profile.Stage( "stamps" ):
+				self._RenderLines( )
+		except ValueError as detail:
+			if( self._error == None ):
+				self._error = detail
+
+	def Barcode( self ):
+		return self._barcodeData.Barcode( )
+
+	def Error( self ):
+		return self._error
+
+	def Run( self ):
+		return self._run
+
+	def GetCCode( self ):
+		if(( self._error == None ) and
+			( self._findCapillary._capillaryFound == True ) and
+			( self._illumCamCalib._illuminationCalibrationPassed == True ) and
+			( self._pvTest._pressureVelocityTestPassed == True ) and
+			( self._capCal._capillaryCalibrationPassed == True ) and
+			( self._dataCol._dataCollectionStarted == True )):
+			return 'p'
+		return 'f'
+
+	def GetLines( self ):
+		# the lines of the report and where they go on the page, as
+		# ( x, y, text ) in figure coordinates, up to the failed stage
+		return self._lines
+
+	def GetRecord( self ):
+		# the report as a dict keyed by ReportFields, a stage that was
+		# not evaluated is None, otherwise "pass" or "fail"
+		record = dict.fromkeys( ReportFields )
+		record[ "log" ] = self._logFname
+		record[ "run" ] = self._run
+		record[ "instrument" ] = self._instr
+		if( self._error != None ):
+			record[ "error" ] = str( self._error )
+
+		if( self._barcodeData != None ):
+			record[ "barcode" ] = self._barcodeData._barcode
+			record[ "category" ] = self._barcodeData._category
+		if( len( self._lines ) > 2 ):
+			# the barcode line rendered, so its time stamp parsed
+			record[ "rundate" ] = self._barcodeData._dtStamp.GetDate( )
+			record[ "runtime" ] = self._barcodeData._dtStamp.GetTime( )
+		if( self._findCapillary != None ):
+			record[ "findCapillary" ] = PassFail( self._findCapillary._capillaryFound )
+		if( self._illumCamCalib != None ):
+			record[ "illuminationCalibration" ] = PassFail( self._illumCamCalib._illuminationCalibrationPassed )
+			record[ "cameraCalibration" ] = PassFail( self._illumCamCalib._cameraCalibrationPassed )
+		if( self._pvTest != None ):
+			record[ "pressureVelocityTest" ] = PassFail( self._pvTest._pressureVelocityTestPassed )
+		if( self._capCal != None ):
+			record[ "capillaryCalibration" ] = PassFail( self._capCal._capillaryCalibrationPassed )
+		if( self._dataCol != None ):
+			record[ "dataCollection" ] = PassFail( self._dataCol._dataCollectionStarted )
+		record[ "ccode" ] = self.GetCCode( )
+		return record
+
+	def _RenderLines( self ):
+		lines = self._lines
+		lines.append(( 0.10, 0.88, ReportTitle ))
+		lines.append(( 0.10, 0.84, self._header.GetReport( )))
+		if( self._barcodeData == None ):
+			return
+
+		lines.append(( 0.10, 0.79, self._barcodeData.GetReport( )))
+		lines.append(( 0.10, 0.75, 'Processes:' ))
+		if( self._findCapillary != None ):
+			lines.append(( 0.14, 0.72, self._findCapillary.GetReport( )))
+		if( self._illumCamCalib != None ):
+			lines.append(( 0.14, 0.70, self._illumCamCalib.GetIllumReport( )))
+			lines.append(( 0.14, 0.68, self._illumCamCalib.GetCameraReport( )))
+		if( self._pvTest != None ):
+			lines.append(( 0.14, 0.66, self._pvTest.GetReport( )))
+		if( self._capCal != None ):
+			lines.append(( 0.14, 0.64, self._capCal.GetReport( )))
+		if( self._dataCol != None ):
+			lines.append(( 0.14, 0.62, self._dataCol.GetReport( )))
+
+class IndexedLog:
+	def __init__( self, path, pool = None, localPath = None ):
+		# pool is the LogChainResolver that bounds how many logs are
+		# mapped at once, it is told whenever this log maps its file,
+		# and localPath a copy of the file to map instead of path
+		self._path = path
+		self._pool = pool
+		self._localPath = localPath
+		if( localPath == None ):
+			self._localPath = path
+		self._file = None
+		self._mm = None
+		mm = self._Map( )
+		self._size = len( mm )
+
+		# walk the whole file once, recording the byte offset of every
+		# marker occurrence in a per marker array (in file order)
+		self._offsets = [ array( 'l' ) for marker in LogMarkers ]
+		for offset, slot in FindLogMarkers( mm, 0, self._size ):
+			self._offsets[ slot ].append( offset )
+
+		self._slots = {}
+		for slot, marker in enumerate( LogMarkers ):
+			self._slots[ marker ] = slot
+
+		# newline offsets, found one block at a time as lines are looked
+		# up, and the ( rundate, runtime ) already parsed for a line
+		self._lineBreaks = {}
+		self._lineStamps = {}
+
+	def Path( self ):
+		return self._path
+
+	def GetLineStamp( self, index ):
+		# the ( rundate, runtime ) of the log line holding index
+		lineIndex = self.LineBreak( index )
+		if( lineIndex == -1 ):
+			raise ValueError( "Can't locate beginning of the line" )
+
+		stamp = self._lineStamps.get( lineIndex )
+		if( stamp == None ):
+			stamp = ParseLineStamp( self._Map( )[ lineIndex : index ] )
+			self._lineStamps[ lineIndex ] = stamp
+		return stamp
+
+	def Offsets( self, marker ):
+		# the byte offsets of every occurrence of marker, in file order
+		return self._offsets[ self._slots[ marker ]]
+
+	def Summary( self ):
+		# ( size, marker offsets, line starts, lines ), the marker index
+		# and the lines the markers are on, each with the newline before
+		# it, which is all of the log a SparseLog keeps
+		mm = self._Map( )
+		streams = [[( offset, slot ) for offset in offsets ] for slot, offsets in enumerate( self._offsets )]
+		starts = array( 'l' )
+		lines = []
+		lineEnd = -1
+		for offset, slot in heapq.merge( *streams ):
+			if( offset > lineEnd ):
+				lineStart = max( mm.rfind( "\n", 0, offset ), 0 )
+				lineEnd = mm.find( "\n", offset + len( LogMarkers[ slot ]))
+				if( lineEnd == -1 ):
+					lineEnd = self._size - 1
+				starts.append( lineStart )
+				lines.append( mm[ lineStart : lineEnd + 1 ] )
+		return ( self._size, [ offsets.tostring( ) for offsets in self._offsets ], starts.tostring( ), lines )
+
+	def LineBreak( self, index ):
+		# offset of the last newline before index, mm.rfind( "\n", 0, index )
+		index = min( index, self._size )
+		block = ( index - 1 ) // LineIndexBlockSize
+		while( block >= 0 ):
+			lineBreaks = self._GetLineBreaks( block )
+			i = bisect_left( lineBreaks, index ) - 1
+			if( i >= 0 ):
+				return lineBreaks[ i ]
+			block -= 1
+		return -1
+
+	def find( self, sub, start = 0, end = None ):
+		slot = self._slots.get( sub )
+		if( slot == None ):
+			return self._Map( ).find( sub, *self._bounds( start, end ))
+
+		start, end = self._clip( start, end )
+		offsets = self._offsets[ slot ]
+		i = bisect_left( offsets, start )
+		if(( i < len( offsets )) and ( offsets[ i ] + len( sub ) <= end )):
+			return offsets[ i ]
+		return -1
+
+	def rfind( self, sub, start = 0, end = None ):
+		slot = self._slots.get( sub )
+		if( slot == None ):
+			return self._Map( ).rfind( sub, *self._bounds( start, end ))
+
+		start, end = self._clip( start, end )
+		offsets = self._offsets[ slot ]
+		i = bisect_right( offsets, end - len( sub )) - 1
+		if(( i >= 0 ) and ( offsets[ i ] >= start )):
+			return offsets[ i ]
+		return -1
+
+	def close( self ):
+		# unmap the file and close it, the marker index is kept and the
+		# file is mapped again if its bytes are needed later on
+		if( self._mm != None ):
+			self._mm.close()
+			self._file.close()
+			self._mm = None
+			self._file = None
+
+	def __getitem__( self, key ):
+		return self._Map( )[ key ]
+
+	def __len__( self ):
+		return self._size
+
+	def _bounds( self, start, end ):
+		if( end == None ):
+			return ( start, )
+		return ( start, end )
+
+	def _GetLineBreaks( self, block ):
+		lineBreaks = self._lineBreaks.get( block )
+		if( lineBreaks == None ):
+			start = block * LineIndexBlockSize
+			end = min( start + LineIndexBlockSize, self._size )
+			lineBreaks = array( 'l', [ match.start( ) for match in NewlinePattern.finditer( self._Map( ), start, end )])
+			self._lineBreaks[ block ] = lineBreaks
+		return lineBreaks
+
+	def _Map( self ):
+		if( self._mm == None ):
+			try:
+				self._file = open( self._localPath, 'r' )
+			except IOError:
+				if( self._localPath == self._path ):
+					raise
+				# the local copy was removed from the stage since it
+				# was last mapped, the log itself is still there
+				self._localPath = self._path
+				self._file = open( self._path, 'r' )
+			try:
+				self._mm = mmap.mmap( self._file.fileno(), 0, access=mmap.ACCESS_READ )
+			except:
+				self._file.close()
+				self._file = None
+				raise
+			if( self._pool != None ):
+				self._pool.Retain( self )
+		return self._mm
+
+	def _clip( self, start, end ):
+		# same negative and out of range index handling as mmap.find
+		size = self._size
+		if( end == None ):
+			end = size
+		if( start < 0 ):
+			start = max( start + size, 0 )
+		if( end < 0 ):
+			end = max( end + size, 0 )
+		return ( start, min( end, size ))
+
+class JsonIndex:
+	def __init__( self, path ):
+		# entries by key in the JSON file at path, and the ones recorded
+		# since the last Save, None for an entry that was removed
+		self._path = path
+		self._entries = self._Load( )
+		self._new = {}
+
+	def Save( self ):
+		# the recorded entries written over what the file has by then,
+		# only when there are any and somewhere to put them
+		if(( len( self._new ) == 0 ) or ( not os.path.isdir( os.path.dirname( self._path )))):
+			return
+		entries = self._Load( )
+		for key, entry in self._new.items( ):
+			if( entry == None ):
+				entries.pop( key, None )
+			else:
+				entries[ key ] = entry
+		SaveJson( self._path, self._Dump( entries ))
+		self._new = {}
+
+	def _Dump( self, entries ):
+		# what the file holds for entries
+		return entries
+
+	def _Load( self ):
+		# the entries the file holds
+		return LoadJson( self._path )
+
+	def _Put( self, key, entry ):
+		self._entries[ key ] = entry
+		self._new[ key ] = entry
+
+class LiveLog( IndexedLog ):
+	def __init__( self, path, pool = None ):
+		# A log that is still being written. Its marker index covers the
+		# complete lines written so far, and Extend( ) adds the lines
+		# written since, scanning only their bytes.
+		self._path = path
+		self._pool = pool
+		self._localPath = path
+		self._file = None
+		self._mm = None
+		self._size = 0
+		self._offsets = [ array( 'l' ) for marker in LogMarkers ]
+		self._slots = {}
+		for slot, marker in enumerate( LogMarkers ):
+			self._slots[ marker ] = slot
+		self._lineBreaks = {}
+		self._lineStamps = {}
+		self.Extend( )
+
+	def Extend( self ):
+		# index the lines completed since the last call, returns the
+		# offset the new lines start at, len( self ) when there are none
+		start = self._size
+		if( os.path.getsize( self._path ) <= start ):
+			return start
+
+		# map the file again to see the bytes written since, a line
+		# that has no newline yet is left for the next call
+		self.close( )
+		mm = self._Map( )
+		end = mm.rfind( "\n", start ) + 1
+		if( end <= start ):
+			return start
+		for offset, slot in FindLogMarkers( mm, start, end ):
+			self._offsets[ slot ].append( offset )
+
+		# the block of line breaks the old end was in is found again
+		self._lineBreaks.pop( start // LineIndexBlockSize, None )
+		self._size = end
+		return start
+
+class LogChainResolver:
+	def __init__( self, maxMapped, profile, stage, live = False, mapSize = None, summaries = None, names = None ):
+		# every log opened during the run, by path, so each file is
+		# indexed once, and the ones currently mapped, least recently
+		# used first, of which at most maxMapped are kept open. Logs
+		# that are still being written are opened as LiveLogs when live
+		# is set, logs larger than mapSize bytes are never mapped, logs
+		# that have a summary are opened from it, and a chain that goes
+		# on in another directory is found through the names index.
+		self._summaries = summaries
+		self._names = names
+		self._logs = {}
+		self._opened = {}
+		self._mapped = OrderedDict( )
+		self._maxMapped = maxMapped
+		self._profile = profile
+		self._stage = stage
+		self._live = live
+		self._mapSize = mapSize
+
+	def AddSummaries( self, summaries ):
+		# logs another process decompressed, by path, as GetSummaries
+		# has them, the ones that are unchanged are not read again
+		for path, ( summary, size, mtime ) in summaries.items( ):
+			if( path in self._logs ):
+				continue
+			try:
+				st = os.stat( path )
+			except OSError:
+				continue
+			if(( st.st_size == size ) and ( st.st_mtime == mtime )):
+				self._logs[ path ] = SparseLog( path, [], summary )
+				self._opened[ path ] = ( size, mtime )
+
+	def Close( self ):
+		for log in self._mapped.values( ):
+			log.close( )
+		self._mapped.clear( )
+
+	def Forget( self, path ):
+		# drop the log at path, it is indexed again if it is opened again
+		log = self._logs.pop( path, None )
+		self._opened.pop( path, None )
+		self._mapped.pop( path, None )
+		if( log != None ):
+			log.close( )
+
+	def GetCounts( self ):
+		return { "logs": len( self._logs ), "mapped": len( self._mapped ) }
+
+	def GetNextFilename( self, mm ):
+		nextFileName = self.GetNextName( mm )
+		if( nextFileName == "" ):
+			return ""
+		basePath = os.path.dirname( mm.Path( )) + '/' + nextFileName
+		nextPath = FindLogPath( basePath )
+		if(( nextPath == None ) and ( self._names != None )):
+			# a chain that goes on in another day's log directory
+			nextPath = self._names.Find( nextFileName )
+		if( nextPath == None ):
+			return basePath + LogSuffixes[ 0 ]
+		return nextPath
+
+	def GetNextName( self, mm ):
+		# the name the n3d entry of mm gives, without a suffix
+		n3dSearchStr = ":n3d "
+
+		nextFileNameIndex = mm.rfind( n3dSearchStr )
+		if( nextFileNameIndex == -1 ):
+			return ""
+
+		return mm[ nextFileNameIndex + len( n3dSearchStr ) : mm.find( "\n", nextFileNameIndex )].strip()
+
+	def GetSummaries( self, paths ):
+		# the ( Summary( ), size, mtime ) of the compressed logs of paths
+		# that were decompressed, by path, for AddSummaries
+		summaries = {}
+		for path in paths:
+			log = self._logs.get( path )
+			if(( log != None ) and ( path in self._opened ) and path.endswith( LogSuffixes[ 1 : ] )):
+				summaries[ path ] = ( log.Summary( ), ) + self._opened[ path ]
+		return summaries
+
+	def Next( self, mm ):
+		# the log that mm continues in, or None when mm has no n3d entry
+		with self._profile.Stage( "chain" ):
+			nextFileName = self.GetNextFilename( mm )
+		if( nextFileName == "" ):
+			return None
+
+		try:
+			return self.Open( nextFileName )
+		except IOError as detail:
+			filenotfound = 'file not found:' + os.path.basename(nextFileName)
+			raise ValueError(filenotfound)
+
+	def Open( self, path ):
+		log = self._logs.get( path )
+		if( log != None ):
+			return log
+
+		# the log is summarized, and refreshed, as it was before it was read
+		try:
+			st = os.stat( path )
+		except OSError:
+			st = None
+		if( self._summaries != None ):
+			with self._profile.Stage( "summary" ):
+				log = self._summaries.Get( path )
+			if( log != None ):
+				self._profile.Opened( 0 )
+		if( log == None ):
+			localPath = path
+			if( self._stage != None ):
+				with self._profile.Stage( "stage" ):
+					localPath = self._stage.Stage( path )
+			with self._profile.Stage( "index" ):
+				if( path.endswith( LogSuffixes[ 1 : ] )):
+					log = SparseLog( path, ReadCompressedLog( localPath ))
+				elif( self._live ):
+					log = LiveLog( path, self )
+				elif(( self._mapSize != None ) and ( os.path.getsize( localPath ) > self._mapSize )):
+					log = SparseLog( path, ReadLogBlocks( localPath ))
+				else:
+					log = self._Map( path, localPath )
+			self._profile.Opened( len( log ))
+			if(( self._summaries != None ) and ( st != None )):
+				with self._profile.Stage( "summary" ):
+					self._summaries.Put( log, st )
+		self._logs[ path ] = log
+		if( st != None ):
+			self._opened[ path ] = ( st.st_size, st.st_mtime )
+		return log
+
+	def Refresh( self ):
+		# forget the logs that changed since they were opened, a resolver
+		# that is kept between requests indexes them again
+		for path, opened in self._opened.items( ):
+			try:
+				st = os.stat( path )
+				current = ( st.st_size, st.st_mtime )
+			except OSError:
+				current = None
+			if( current != opened ):
+				self.Forget( path )
+
+	def Retain( self, log ):
+		# called by a log when it maps its file, unmap the least recently
+		# mapped logs beyond the limit
+		if( log.Path( ) in self._logs ):
+			# mapped again after it was unmapped, nothing is rescanned
+			self._profile.Opened( 0 )
+		self._mapped.pop( log.Path( ), None )
+		self._mapped[ log.Path( )] = log
+		while( len( self._mapped ) > self._maxMapped ):
+			path, oldest = self._mapped.popitem( last=False )
+			oldest.close( )
+
+	def _Map( self, path, localPath ):
+		try:
+			return IndexedLog( path, self, localPath )
+		except ( EnvironmentError, OverflowError ) as detail:
+			# there is not enough address space left to map the file,
+			# it is read a block at a time instead
+			if( isinstance( detail, EnvironmentError ) and ( detail.errno not in ( errno.ENOMEM, errno.EOVERFLOW ))):
+				raise
+			return SparseLog( path, ReadLogBlocks( localPath ))
+
+class LogDirWatch:
+	def __init__( self, poll ):
+		# Waits for the files of the watched log directories to change,
+		# with inotify unless poll is set or libc has none. Whatever the
+		# wait, every file is looked at again when it times out, inotify
+		# sees nothing of the files written through a network mount.
+		self._fd = -1
+		self._dirs = {}
+		self._watches = {}
+		if(( not poll ) and ( libc != None )):
+			self._fd = libc.inotify_init( )
+
+	def Close( self ):
+		if( self._fd != -1 ):
+			os.close( self._fd )
+			self._fd = -1
+
+	def Dirs( self ):
+		return self._dirs.keys( )
+
+	def Unwatch( self, logdir ):
+		wd = self._dirs.pop( logdir, None )
+		if(( wd != None ) and ( wd != -1 )):
+			libc.inotify_rm_watch( self._fd, wd )
+			del self._watches[ wd ]
+
+	def Wait( self, seconds ):
+		# the paths of the files that changed, or None when every file
+		# is to be looked at
+		if( self._fd == -1 ):
+			time.sleep( seconds )
+			return None
+
+		if( len( select.select([ self._fd ], [], [], seconds )[ 0 ] ) == 0 ):
+			return None
+		events = os.read( self._fd, 64 * 1024 )
+		paths = set( )
+		offset = 0
+		while( offset + InotifyEventHeader.size <= len( events )):
+			wd, mask, cookie, length = InotifyEventHeader.unpack_from( events, offset )
+			offset += InotifyEventHeader.size
+			name = events[ offset : offset + length ].rstrip( "\0" )
+			offset += length
+			if( mask & InotifyOverflow ):
+				return None
+			logdir = self._watches.get( wd )
+			if(( logdir != None ) and ( name != "" )):
+				paths.add( logdir + "/" + name )
+		return paths
+
+	def Watch( self, logdir ):
+		# watch logdir once it exists, True when it is watched
+		if( logdir in self._dirs ):
+			return True
+		if( not os.path.isdir( logdir )):
+			return False
+		wd = -1
+		if( self._fd != -1 ):
+			wd = libc.inotify_add_watch( self._fd, logdir, InotifyMask )
+			if( wd != -1 ):
+				self._watches[ wd ] = logdir
+		self._dirs[ logdir ] = wd
+		return True
+
+class LogFollower:
+	def __init__( self, config ):
+		# the followed log files by path, the runs seen in each of them,
+		# the runs that have not ended yet as ( log file name, run, log,
+		# offset of the :USER: start entry ), and the last run reported
+		# in each file, until another run starts in it
+		self._config = config
+		self._resolver = GetLogResolver( config )
+		self._watch = LogDirWatch( config.Poll( ))
+		self._logs = OrderedDict( )
+		self._runs = {}
+		self._pending = []
+		self._lastReports = {}
+
+	def Close( self ):
+		self._watch.Close( )
+
+	def Poll( self, paths ):
+		# look at the files that may have changed, every file when paths
+		# is None, and report the runs that ended
+		config = self._config
+		config.FollowToday( )
+		self._watch.Watch( config.LogDir( ))
+		if( paths == None ):
+			paths = set( self._logs.keys( ))
+			for logdir in self._watch.Dirs( ):
+				try:
+					paths.update( logdir + "/" + fname for fname in os.listdir( logdir ))
+				except OSError:
+					continue
+
+		for path in sorted( paths ):
+			if( os.path.dirname( path ) in self._watch.Dirs( )):
+				self._Extend( path )
+		self._Report( )
+		self._Retire( )
+
+	def Run( self ):
+		while( True ):
+			self.Poll( self._watch.Wait( self._config.Interval( )))
+
+	def _Extend( self, path ):
+		# index what was written to path since it was last looked at,
+		# and the runs that started in it, the files of the directory
+		# that are not log files, or are compressed, are left alone
+		log = self._logs.get( path )
+		try:
+			if( log == None ):
+				fname = os.path.basename( path )
+				if(( not LogFnamePattern.match( fname )) or fname.endswith( LogSuffixes[ 1 : ] ) or ( not os.path.isfile( path ))):
+					return
+				log = self._resolver.Open( path )
+				self._logs[ path ] = log
+				self._runs[ path ] = 0
+				log.Extend( )
+				start = 0
+			else:
+				start = log.Extend( )
+		except ( IOError, OSError ):
+			return
+
+		offsets = []
+		for marker in RunStartMarkers:
+			markerOffsets = log.Offsets( marker )
+			offsets.extend( markerOffsets[ bisect_left( markerOffsets, start ) : ] )
+		for userStartIndex in sorted( offsets ):
+			if( path in self._lastReports ):
+				self._Renumber( path )
+			self._runs[ path ] += 1
+			self._pending.append(( os.path.basename( path ), self._runs[ path ], log, userStartIndex ))
+
+	def _Renumber( self, path ):
+		# the run reported as the last one in path is not, give its
+		# reports the names of a run that has another run after it
+		logFname, report = self._lastReports.pop( path )
+		if(( self._config.Format( ) != 'pdf' ) or ( report.Error( ) != None )):
+			return
+		oldPaths = GetPdfReportPaths( self._config, logFname, report, True )
+		newPaths = GetPdfReportPaths( self._config, logFname, report, False )
+		for oldPath, newPath in zip( oldPaths, newPaths ):
+			os.rename( oldPath, newPath )
+		GetReportIndex( self._config ).Move( oldPaths[ 0 ], newPaths[ 0 ] )
+
+	def _Report( self ):
+		config = self._config
+		profile = GetRunProfile( config )
+		pending = []
+		for logFname, run, log, userStartIndex in self._pending:
+			ended, nextRun, endLog, endIndex = self._RunEnd( log, userStartIndex )
+			if( not ended ):
+				pending.append(( logFname, run, log, userStartIndex ))
+				continue
+
+			# a run the next run has not started after yet is the last
+			# one in its file for now
+			window = RunWindow( self._resolver, endLog, endIndex )
+			profile.Begin( logFname )
+			report = InitReport( config, window, logFname, run, log, userStartIndex )
+			EmitReport( config, log.Path( ), report, ( not nextRun ) or ( endLog != log ))
+			profile.Run( window.Depth( ))
+			if( not nextRun ):
+				self._lastReports[ log.Path( )] = ( logFname, report )
+
+		if( len( pending ) < len( self._pending )):
+			GetReportIndex( config ).Save( )
+			profile.Emit( profile.TakeRecords( ))
+			sys.stdout.flush( )
+		self._pending = pending
+
+	def _Retire( self ):
+		# stop following the directories of the days before the current
+		# one once none of their runs is left to report
+		logdirs = set( os.path.dirname( log.Path( )) for logFname, run, log, userStartIndex in self._pending )
+		for logdir in self._watch.Dirs( ):
+			if(( logdir == self._config.LogDir( )) or ( logdir in logdirs )):
+				continue
+			self._watch.Unwatch( logdir )
+			for path in self._logs.keys( ):
+				if( os.path.dirname( path ) == logdir ):
+					del self._logs[ path ]
+					del self._runs[ path ]
+					self._lastReports.pop( path, None )
+					self._resolver.Forget( path )
+
+	def _RunEnd( self, log, userStartIndex ):
+		# ( ended, next run, end log, end offset ) of the run starting at
+		# userStartIndex of log. It has ended when it has reached one of
+		# RunEndMarkers or the next run has started, and it ends where the
+		# next run starts, or for now where the followed logs end.
+		mm = log
+		index = userStartIndex + 1
+		ended = False
+		followed = set( )
+		while( mm.Path( ) not in followed ):
+			followed.add( mm.Path( ))
+			nextStarts = [ mm.find( marker, index ) for marker in RunStartMarkers ]
+			nextStarts = [ nextStart for nextStart in nextStarts if nextStart != -1 ]
+			end = len( mm )
+			if( len( nextStarts ) > 0 ):
+				end = min( nextStarts )
+			for marker in RunEndMarkers:
+				if( mm.find( marker, index, end ) != -1 ):
+					ended = True
+			if( len( nextStarts ) > 0 ):
+				return ( True, True, mm, end )
+
+			# a log the chain continues in is only searched once it is
+			# followed itself
+			nextPath = self._resolver.GetNextFilename( mm )
+			if( nextPath not in self._logs ):
+				break
+			mm = self._logs[ nextPath ]
+			index = 0
+		return ( ended, False, mm, len( mm ))
+
+class LogNameIndex( JsonIndex ):
+	def __init__( self, root, rptdir ):
+		# The path of every log file under root, an instrument's ucm_logs
+		# tree, by its name without a suffix. It is kept in rptdir/
+		# lognames.json with the mtime, subdirectories and log files each
+		# directory had when it was listed, and a directory is only listed
+		# again once its mtime changed. The directories listed, or gone,
+		# since the last TakeDirs are kept apart for the parent process.
+		self._root = root
+		self._rptdir = rptdir
+		JsonIndex.__init__( self, rptdir + '/lognames.json' )
+		self._names = {}
+		self._refreshed = None
+		for dirPath in self._entries:
+			self._AddNames( dirPath )
+
+	def AddDirs( self, dirs ):
+		# directories taken from the index of a worker process, None for
+		# a directory that is gone
+		for dirPath, entry in dirs.items( ):
+			self._SetDir( dirPath, entry )
+
+	def Find( self, name ):
+		# the path of the log file name, None when the tree has none
+		path = self._names.get( name )
+		if(( path != None ) and os.path.exists( path )):
+			return path
+		if(( self._refreshed == None ) or ( time.time( ) - self._refreshed >= LogNameRefresh )):
+			self.Refresh( )
+			path = self._names.get( name )
+		return path
+
+	def Refresh( self ):
+		# list the directories of the tree that changed since they were
+		# listed, and the new ones
+		self._refreshed = time.time( )
+		self._Scan( self._root )
+
+	def Root( self ):
+		return self._root
+
+	def RptDir( self ):
+		return self._rptdir
+
+	def TakeDirs( self ):
+		dirs = self._new
+		self._new = {}
+		return dirs
+
+	def _AddNames( self, dirPath ):
+		# the log files of dirPath, an uncompressed one before the
+		# compressed ones of the same name, as GetLogPath has it
+		added = set( )
+		for fname in self._entries[ dirPath ][ 2 ]:
+			name = GetLogName( fname )
+			if( name not in added ):
+				self._names[ name ] = dirPath + "/" + fname
+				added.add( name )
+
+	def _DropNames( self, dirPath ):
+		for fname in self._entries[ dirPath ][ 2 ]:
+			name = GetLogName( fname )
+			if( self._names.get( name ) == dirPath + "/" + fname ):
+				del self._names[ name ]
+
+	def _Dump( self, entries ):
+		return { 'root': self._root, 'dirs': entries }
+
+	def _Load( self ):
+		# the listings of another tree are not used
+		saved = LoadJson( self._path )
+		if( saved.get( 'root' ) != self._root ):
+			return {}
+		return saved[ 'dirs' ]
+
+	def _Scan( self, dirPath ):
+		try:
+			mtime = os.stat( dirPath ).st_mtime
+		except OSError:
+			if( dirPath in self._entries ):
+				self._SetDir( dirPath, None )
+			return
+
+		entry = self._entries.get( dirPath )
+		if(( entry == None ) or ( entry[ 0 ] != mtime )):
+			subdirs = []
+			files = []
+			for fname in sorted( os.listdir( dirPath )):
+				if( os.path.isdir( dirPath + "/" + fname )):
+					subdirs.append( fname )
+				elif( fname.endswith( LogSuffixes )):
+					files.append( fname )
+			entry = [ mtime, subdirs, files ]
+			self._SetDir( dirPath, entry )
+
+		for subdir in entry[ 1 ]:
+			self._Scan( dirPath + "/" + subdir )
+
+	def _SetDir( self, dirPath, entry ):
+		# the listing of dirPath, None when it is gone
+		if( dirPath in self._entries ):
+			self._DropNames( dirPath )
+			del self._entries[ dirPath ]
+		self._new[ dirPath ] = entry
+		if( entry != None ):
+			self._entries[ dirPath ] = entry
+			self._AddNames( dirPath )
+
+class LogReadahead:
+	def __init__( self, config, chains, depth ):
+		# Reads the log files of chains, in order, on a thread of its own
+		# while the chains before them are evaluated, so their pages are
+		# cached, or copied to the stage, by the time they are indexed. At
+		# most depth chains are read and not yet Done( ), and a log that
+		# has a summary is not read at all.
+		self._config = config
+		self._chains = chains
+		self._stage = GetLogStage( config )
+		self._summaries = GetLogSummaryCache( config )
+		self._queue = Queue( )
+		self._slots = threading.Semaphore( depth )
+		self._stop = threading.Event( )
+		self._thread = threading.Thread( target=self._Read )
+		self._thread.daemon = True
+		self._thread.start( )
+
+	def Chains( self ):
+		# the chains, each one once it has been read, the wait has a
+		# timeout so that ctrl-c is seen
+		while( True ):
+			try:
+				chain = self._queue.get( True, 1 )
+			except Empty:
+				continue
+			if( chain == None ):
+				return
+			yield chain
+
+	def Close( self ):
+		# stop reading, after the block that is being read
+		self._stop.set( )
+		self._slots.release( )
+		while( self._thread.is_alive( )):
+			self._thread.join( 0.1 )
+
+	def Done( self ):
+		# a chain that was read has been evaluated, read another
+		self._slots.release( )
+
+	def _Read( self ):
+		try:
+			for chain in self._chains:
+				self._slots.acquire( )
+				for logFname in chain:
+					if( self._stop.is_set( )):
+						return
+					path = self._config.LogDir( ) + "/" + logFname
+					try:
+						if(( self._summaries != None ) and self._summaries.Has( path )):
+							continue
+						if( self._stage != None ):
+							self._stage.Stage( path )
+						else:
+							self._ReadThrough( path )
+					except Exception:
+						# a log that can't be read ahead is read when its
+						# chain is evaluated, which reports what is wrong
+						pass
+				self._queue.put( chain )
+		finally:
+			self._queue.put( None )
+
+	def _ReadThrough( self, path ):
+		# only the pages left in the cache are wanted, not what is read
+		with open( path, 'rb' ) as f:
+			while(( not self._stop.is_set( )) and f.read( LogBlockSize )):
+				pass
+
+class LogRunIndex( JsonIndex ):
+	def __init__( self, rptdir ):
+		# the number of runs that start in each log, with the size and
+		# mtime of the log when it was counted, in rptdir/logruns.json,
+		# and the counts recorded since the last TakeEntries
+		self._rptdir = rptdir
+		JsonIndex.__init__( self, rptdir + '/logruns.json' )
+
+	def AddEntries( self, entries ):
+		# entries taken from the index of a worker process
+		for logPath, entry in entries.items( ):
+			self._Put( logPath, entry )
+
+	def Get( self, logPath ):
+		# the recorded number of runs, or None when the log has changed
+		# since it was recorded or was never recorded
+		entry = self._entries.get( logPath )
+		if( entry == None ):
+			return None
+		size, mtime, runs = entry
+		try:
+			st = os.stat( logPath )
+		except OSError:
+			return None
+		if(( st.st_size != size ) or ( st.st_mtime != mtime )):
+			return None
+		return runs
+
+	def Record( self, logPath, runs ):
+		st = os.stat( logPath )
+		entry = [ st.st_size, st.st_mtime, runs ]
+		if( self._entries.get( logPath ) != entry ):
+			self._Put( logPath, entry )
+
+	def RptDir( self ):
+		return self._rptdir
+
+	def TakeEntries( self ):
+		entries = self._new
+		self._new = {}
+		return entries
+
+class LogStage:
+	def __init__( self, stagedir, budget ):
+		# local copies of log files, in stagedir, of at most budget bytes
+		# in all, and the copies being made, each with the event that is
+		# set when it is done
+		self._stagedir = stagedir
+		self._budget = budget
+		self._lock = threading.Lock( )
+		self._copying = {}
+		self._queue = None
+		if( not os.path.isdir( stagedir )):
+			os.makedirs( stagedir )
+
+	def Prefetch( self, paths ):
+		# copy paths to the stage in the background, in order
+		with self._lock:
+			if( self._queue == None ):
+				self._queue = Queue( )
+				for i in range( StageThreads ):
+					thread = threading.Thread( target=self._PrefetchThread )
+					thread.daemon = True
+					thread.start( )
+		for path in paths:
+			self._queue.put( path )
+
+	def Stage( self, path ):
+		# the local copy of path, copied now unless a current copy exists
+		# or is being made, path itself when it can't be copied
+		try:
+			st = os.stat( path )
+		except OSError:
+			return path
+		localPath = "%s/%s_%d_%d_%s" % ( self._stagedir, hashlib.sha1( path ).hexdigest( )[ :16 ],
+			st.st_size, int( st.st_mtime * 1000000 ), os.path.basename( path ))
+
+		with self._lock:
+			done = self._copying.get( localPath )
+			if(( done == None ) and os.path.exists( localPath )):
+				# used now, the least recently used copies go first, a
+				# copy another process just evicted is made again
+				try:
+					os.utime( localPath, None )
+					return localPath
+				except OSError as detail:
+					if( detail.errno != errno.ENOENT ):
+						raise
+			copying = ( done == None )
+			if( copying ):
+				done = threading.Event( )
+				self._copying[ localPath ] = done
+
+		if( not copying ):
+			done.wait( )
+		else:
+			try:
+				self._Copy( path, localPath )
+			except ( IOError, OSError ):
+				pass
+			finally:
+				with self._lock:
+					del self._copying[ localPath ]
+				done.set( )
+			self._Evict( localPath )
+
+		if( os.path.exists( localPath )):
+			return localPath
+		return path
+
+	def _Copy( self, path, localPath ):
+		# copy to a temporary name and rename it, so a copy that exists
+		# is always complete, also when another process stages the file
+		tmpPath = GetTempPath( localPath )
+		try:
+			with open( path, 'rb' ) as src:
+				with open( tmpPath, 'wb' ) as dst:
+					shutil.copyfileobj( src, dst, StageCopySize )
+			os.rename( tmpPath, localPath )
+		finally:
+			if( os.path.exists( tmpPath )):
+				os.unlink( tmpPath )
+
+	def _Evict( self, keep ):
+		# remove the least recently used copies, other than keep, until
+		# the copies fit in the budget, the other files in stagedir are
+		# not ours
+		copies = []
+		total = 0
+		for fname in os.listdir( self._stagedir ):
+			if(( not StageCopyPattern.match( fname )) or fname.endswith( ".tmp" )):
+				continue
+			try:
+				st = os.stat( self._stagedir + "/" + fname )
+			except OSError:
+				continue
+			copies.append(( st.st_mtime, st.st_size, self._stagedir + "/" + fname ))
+			total += st.st_size
+
+		for mtime, size, localPath in sorted( copies ):
+			if( total <= self._budget ):
+				break
+			if( localPath == keep ):
+				continue
+			try:
+				os.unlink( localPath )
+				total -= size
+			except OSError:
+				pass
+
+	def _PrefetchThread( self ):
+		while( True ):
+			path = self._queue.get( )
+			try:
+				self.Stage( path )
+			except Exception:
+				# a copy that fails is made again, or read from the log
+				# directory, when the log is opened
+				pass
+
+class LogSummaryCache:
+	def __init__( self, rptdir, budget ):
+		# the Summary( ) of the logs that were read, in rptdir/summaries.db,
+		# with the size and mtime each log had, the least recently used
+		# beyond budget bytes are removed. The bytes of all of them are
+		# kept in the one row of summaryTotal by triggers, so a new summary
+		# only reads the oldest ones when there are too many. Each process
+		# and thread has a connection of its own, opened on first use.
+		self._rptdir = rptdir
+		self._path = rptdir + '/summaries.db'
+		self._budget = budget
+		self._local = threading.local( )
+
+	def Get( self, path ):
+		# a SparseLog of the summary of path, None when there is none
+		# for the log as it is now
+		try:
+			st = os.stat( path )
+		except OSError:
+			return None
+		connection = self._Connect( )
+		row = connection.execute( "SELECT summary FROM summaries WHERE path = ? AND size = ? AND mtime = ?",
+			( path, st.st_size, st.st_mtime )).fetchone( )
+		if( row == None ):
+			return None
+		with connection:
+			connection.execute( "UPDATE summaries SET used = ? WHERE path = ?", ( time.time( ), path ))
+		return SparseLog( path, [], marshal.loads( zlib.decompress( str( row[ 0 ] ))))
+
+	def Has( self, path ):
+		# True when there is a summary for the log as it is now
+		try:
+			st = os.stat( path )
+		except OSError:
+			return False
+		row = self._Connect( ).execute( "SELECT 1 FROM summaries WHERE path = ? AND size = ? AND mtime = ?",
+			( path, st.st_size, st.st_mtime )).fetchone( )
+		return row != None
+
+	def Put( self, log, st ):
+		# the summary of log, which had the stat st when it was read
+		summary = zlib.compress( marshal.dumps( log.Summary( )), 1 )
+		if( len( summary ) > self._budget ):
+			return
+		connection = self._Connect( )
+		with connection:
+			connection.execute( "DELETE FROM summaries WHERE path = ?", ( log.Path( ), ))
+			connection.execute( "INSERT INTO summaries VALUES ( ?, ?, ?, ?, ?, ? )",
+				( log.Path( ), st.st_size, st.st_mtime, time.time( ), len( summary ), sqlite3.Binary( summary )))
+			total = connection.execute( "SELECT bytes FROM summaryTotal WHERE id = 0" ).fetchone( )[ 0 ]
+			if( total <= self._budget ):
+				return
+			evicted = []
+			oldest = connection.execute( "SELECT path, bytes FROM summaries ORDER BY used" )
+			for path, nbytes in oldest:
+				if( total <= self._budget ):
+					break
+				evicted.append(( path, ))
+				total -= nbytes
+			oldest.close( )
+			connection.executemany( "DELETE FROM summaries WHERE path = ?", evicted )
+
+	def RptDir( self ):
+		return self._rptdir
+
+	def _Connect( self ):
+		local = self._local
+		if( getattr( local, 'pid', None ) != os.getpid( )):
+			self._CreateTables( )
+			local.connection = sqlite3.connect( self._path, timeout=60 )
+			local.pid = os.getpid( )
+		return local.connection
+
+	def _CreateTables( self ):
+		# The tables, and the total of an older summaries.db, in a row
+		# without a key, made again, in one transaction the other
+		# processes wait for. The first one to get here sets the total.
+		connection = sqlite3.connect( self._path, timeout=60, isolation_level=None )
+		try:
+			connection.execute( "BEGIN EXCLUSIVE" )
+			columns = [ row[ 1 ] for row in connection.execute( "PRAGMA table_info( summaryTotal )" )]
+			if( columns == [ "bytes" ] ):
+				CreateTables( connection, (
+					"DROP TRIGGER IF EXISTS summaryAdded",
+					"DROP TRIGGER IF EXISTS summaryRemoved",
+					"DROP TABLE summaryTotal" ))
+			CreateTables( connection, (
+				"CREATE TABLE IF NOT EXISTS summaries ( path TEXT PRIMARY KEY, size INTEGER, mtime REAL,"
+				" used REAL, bytes INTEGER, summary BLOB )",
+				"CREATE INDEX IF NOT EXISTS summariesByUse ON summaries ( used )",
+				"CREATE TABLE IF NOT EXISTS summaryTotal ( id INTEGER PRIMARY KEY CHECK ( id = 0 ), bytes INTEGER )",
+				"CREATE TRIGGER IF NOT EXISTS summaryAdded AFTER INSERT ON summaries"
+				" BEGIN UPDATE summaryTotal SET bytes = bytes + NEW.bytes WHERE id = 0; END",
+				"CREATE TRIGGER IF NOT EXISTS summaryRemoved AFTER DELETE ON summaries"
+				" BEGIN UPDATE summaryTotal SET bytes = bytes - OLD.bytes WHERE id = 0; END",
+				"INSERT OR IGNORE INTO summaryTotal SELECT 0, COALESCE( SUM( bytes ), 0 ) FROM summaries" ))
+			connection.execute( "COMMIT" )
+		finally:
+			connection.close( )
+
+class LogTailIndex( JsonIndex ):
+	def __init__( self, rptdir ):
+		# the n3d successor name of each compressed log, with the size and
+		# mtime of the log when it was read, in rptdir/logtails.json
+		JsonIndex.__init__( self, rptdir + '/logtails.json' )
+
+	def Get( self, logPath ):
+		# the recorded successor name, or None when the log has changed
+		# since it was recorded or was never recorded
+		entry = self._entries.get( logPath )
+		if( entry == None ):
+			return None
+		size, mtime, nextName = entry
+		st = os.stat( logPath )
+		if(( st.st_size != size ) or ( st.st_mtime != mtime )):
+			return None
+		return nextName
+
+	def Record( self, logPath, nextName ):
+		st = os.stat( logPath )
+		self._Put( logPath, [ st.st_size, st.st_mtime, nextName ])
+
+class NullProfile:
+	# the profile when --profile is not given, every hook does nothing
+	def Begin( self, logFname ):
+		pass
+
+	def Emit( self, records ):
+		pass
+
+	def Opened( self, nbytes ):
+		pass
+
+	def PrintSummary( self ):
+		pass
+
+	def Run( self, chainDepth ):
+		pass
+
+	def Stage( self, name, logFname = None ):
+		return self
+
+	def TakeRecords( self ):
+		return []
+
+	def __enter__( self ):
+		pass
+
+	def __exit__( self, excType, excValue, tb ):
+		return False
+
+class PdfReportTemplate:
+	def __init__( self ):
+		# everything but the page contents is the same for every report,
+		# serialise it once and keep the offsets the xref table needs
+		objects = [
+			"<< /Type /Catalog /Pages 2 0 R >>",
+			"<< /Type /Pages /Kids [ 3 0 R ] /Count 1 >>",
+			"<< /Type /Page /Parent 2 0 R /MediaBox [ 0 0 %d %d ] "
+				"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>" % ( ReportPageWidth, ReportPageHeight ),
+			"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>" ]
+
+		self._prefix = "%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+		self._offsets = []
+		for number, obj in enumerate( objects ):
+			self._offsets.append( len( self._prefix ))
+			self._prefix += "%d 0 obj\n%s\nendobj\n" % ( number + 1, obj )
+
+		self._xrefHead = "xref\n0 %d\n0000000000 65535 f \n" % ( len( objects ) + 2 )
+		for offset in self._offsets:
+			self._xrefHead += "%010d 00000 n \n" % offset
+		self._trailer = "trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n" % ( len( objects ) + 2 )
+
+	def Render( self, lines ):
+		# lines are ( x, y, text ) in figure coordinates, text left
+		# aligned at x with the top of its first line at y
+		content = [ "BT /F1 %d Tf" % ReportFontSize ]
+		for x, y, text in lines:
+			baseline = y * ReportPageHeight - ReportFontAscent
+			for line in text.split( "\n" ):
+				content.append( "1 0 0 1 %.3f %.3f Tm (%s) Tj" % ( x * ReportPageWidth, baseline, PdfString( line )))
+				baseline -= ReportLineStep
+		content.append( "ET" )
+		stream = "\n".join( content )
+
+		contentOffset = len( self._prefix )
+		contents = "5 0 obj\n<< /Length %d >>\nstream\n%s\nendstream\nendobj\n" % ( len( stream ), stream )
+		xrefOffset = contentOffset + len( contents )
+		return self._prefix + contents + self._xrefHead + ( "%010d 00000 n \n" % contentOffset ) \
+			+ self._trailer + "%d\n%%%%EOF\n" % xrefOffset
+
+	def Save( self, path, lines ):
+		# through a rename, so a report that exists is complete
+		tmpPath = GetTempPath( path )
+		try:
+			with open( tmpPath, 'wb' ) as f:
+				f.write( self.Render( lines ))
+			os.rename( tmpPath, path )
+		finally:
+			if( os.path.exists( tmpPath )):
+				os.unlink( tmpPath )
+
 class PressureVelocityTest:
-	def __init__( self, config, mm, startIndex ):
+	def __init__( self, window, mm, startIndex ):
 
 		pvString = "Pressure/PumpPos Slope"
 		fifteenMinString = "Fifteen minute"
@@ -499,15 +2162,20 @@ class PressureVelocityTest:
 		self._mm = mm
 		self._index = startIndex
 		self._pressureVelocityTestPassed = False
-		self._config = config
+		self._window = window
+
+		# the stamp of the last test result found, if any, is reported
+		# when the run ends without a successful one
+		self._dtStamp = DateTimeStamp( )
 
-		userStopIndex = mm.find( userStopString, startIndex )
-		fifteenMinIndex = mm.find( fifteenMinString, startIndex )
+		end = window.End( mm )
+		userStopIndex = mm.find( userStopString, startIndex, end )
+		fifteenMinIndex = mm.find( fifteenMinString, startIndex, end )
 		index = startIndex 
 
 		while( True ):
 
-			pvIndex = mm.find( pvString, index )
+			pvIndex = mm.find( pvString, index, end )
 			if( pvIndex != -1 ):
 
 				# there's a "Pressure/PumpPos Slope" in the file
@@ -579,31 +2247,20 @@ class PressureVelocityTest:
 				self._pressureVelocityTestPassed = False
 				return
 
-			nextFileName = self.GetNextFilename( mm )
-			if( nextFileName == "" ):
+			nextLog = self._window.Next( mm )
+			if( nextLog == None ):
 				# there is no n3d entry in the log file
-				self._dtStamp = DateTimeStamp( )
 				self._pressureVelocityTestPassed= False
 				return
 
-			# open the next log file, and map it
-			f = open( nextFileName, 'r' ) 
-			mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+			# continue in the next log file
+			mm = nextLog
 			self._mm = mm
 
 			index = 0
-			userStopIndex = mm.find( userStopString, 0 )
-			fifteenMinIndex = mm.find( fifteenMinString, 0 )
-
-	def GetNextFilename( self, mm ):
-		n3dSearchStr = ":n3d "
-
-		nextFileNameIndex = mm.rfind( n3dSearchStr )
-		if( nextFileNameIndex == -1 ):
-			return ""
-
-		nextFileName = mm[ nextFileNameIndex + len( n3dSearchStr ) : mm.find( "\n", nextFileNameIndex )].strip()
-		return self._config.LogDir( ) + '/' + nextFileName + '.log'
+			end = self._window.End( mm )
+			userStopIndex = mm.find( userStopString, 0, end )
+			fifteenMinIndex = mm.find( fifteenMinString, 0, end )
 
 	def GetMMap( self ):
 		return self._mm
@@ -614,11 +2271,138 @@ class PressureVelocityTest:
 	def GetReport( self ):
 		rptString = ""
 		if( self._pressureVelocityTestPassed == True ):
-			rptString = "(pass)  Pressure/Velocity test " + self._dtStamp._rundate + " " + self._dtStamp._runtime
+			rptString = "(pass)  Pressure/Velocity test " + self._dtStamp.GetStamp( )
 		else:
-			rptString = "(fail)  Pressure/Velocity test " + self._dtStamp._rundate + " " + self._dtStamp._runtime
+			rptString = "(fail)  Pressure/Velocity test " + self._dtStamp.GetStamp( )
 		return rptString
 
+class ReportIndex:
+	def __init__( self, rptdir ):
+		# the reports table of rptdir/reports.db, and the changes to it
+		# that are written by the next Save
+		self._rptdir = rptdir
+		self._path = rptdir + '/reports.db'
+		self._rows = []
+		self._forget = []
+		self._moves = []
+
+	def Add( self, logPath, record, pdfPath ):
+		# a run of the log at logPath, record is its GetRecord( )
+		row = dict( record )
+		row[ "logpath" ] = logPath
+		row[ "pdf" ] = pdfPath
+		row[ "rundate" ] = IsoDate( record[ "rundate" ])
+		self._rows.append( row )
+
+	def AddRows( self, rows ):
+		# rows taken from the index of a worker process
+		self._rows += rows
+
+	def CountRuns( self, logDir ):
+		# the runs recorded for the logs of logDir, and how many failed
+		if( not os.path.exists( self._path )):
+			return ( 0, 0 )
+		connection = self._Connect( )
+		try:
+			prefix = logDir + "/"
+			return connection.execute( "SELECT COUNT(*), COALESCE( SUM( ccode = 'f' ), 0 ) FROM reports"
+				" WHERE substr( logpath, 1, ? ) = ?", ( len( prefix ), prefix )).fetchone( )
+		finally:
+			connection.close( )
+
+	def Forget( self, logPaths ):
+		# drop the runs of logPaths that are in the table, they are
+		# reported again
+		self._forget += logPaths
+
+	def LogRuns( self, instr, barcode ):
+		# the ( log path, run ) of each recorded run of barcode on instr
+		if( not os.path.exists( self._path )):
+			return []
+		connection = self._Connect( )
+		try:
+			return connection.execute( "SELECT logpath, run FROM reports WHERE instrument = ? AND barcode = ?"
+				" ORDER BY rundate, runtime, log, run", ( instr, barcode )).fetchall( )
+		finally:
+			connection.close( )
+
+	def Move( self, pdfPath, newPdfPath ):
+		# the report at pdfPath was renamed
+		self._moves.append(( newPdfPath, pdfPath ))
+
+	def Query( self, instr, barcode, failed, fromDate, toDate ):
+		# the recorded runs of instr, as records with a pdf key, narrowed
+		# down by whichever of the other arguments are not None or False
+		where = [ "instrument = ?" ]
+		args = [ instr ]
+		if( barcode != None ):
+			where.append( "barcode = ?" )
+			args.append( barcode )
+		if( failed ):
+			where.append( "ccode = 'f'" )
+		if( fromDate != None ):
+			where.append( "rundate >= ?" )
+			args.append( fromDate )
+		if( toDate != None ):
+			where.append( "rundate <= ?" )
+			args.append( toDate )
+
+		records = []
+		if( not os.path.exists( self._path )):
+			return records
+		connection = self._Connect( )
+		try:
+			cursor = connection.execute( "SELECT " + ", ".join( ReportIndexColumns ) +
+				" FROM reports WHERE " + " AND ".join( where ) +
+				" ORDER BY rundate, runtime, log, run", args )
+			for row in cursor:
+				record = dict( zip( ReportIndexColumns, row ))
+				del record[ "logpath" ]
+				if( record[ "rundate" ] != None ):
+					yyyy, mm, dd = record[ "rundate" ].split( "-" )
+					record[ "rundate" ] = mm + "/" + dd + "/" + yyyy
+				records.append( record )
+		finally:
+			connection.close( )
+		return records
+
+	def Save( self ):
+		# write the changes in one transaction
+		if(( len( self._rows ) == 0 ) and ( len( self._forget ) == 0 ) and ( len( self._moves ) == 0 )):
+			return
+		connection = self._Connect( )
+		try:
+			with connection:
+				connection.executemany( "DELETE FROM reports WHERE logpath = ?",
+					[( logPath, ) for logPath in self._forget ])
+				connection.executemany( "INSERT OR REPLACE INTO reports VALUES ( " +
+					", ".join( "?" for column in ReportIndexColumns ) + " )",
+					[[ row[ column ] for column in ReportIndexColumns ] for row in self._rows ])
+				connection.executemany( "UPDATE reports SET pdf = ? WHERE pdf = ?", self._moves )
+		finally:
+			connection.close( )
+		self._rows = []
+		self._forget = []
+		self._moves = []
+
+	def RptDir( self ):
+		return self._rptdir
+
+	def TakeRows( self ):
+		rows = self._rows
+		self._rows = []
+		return rows
+
+	def _Connect( self ):
+		connection = sqlite3.connect( self._path, timeout=60 )
+		columns = [ column + " TEXT" for column in ReportIndexColumns ]
+		columns[ ReportIndexColumns.index( "run" )] = "run INTEGER"
+		CreateTables( connection, (
+			"CREATE TABLE IF NOT EXISTS reports ( " + ", ".join( columns ) + ", PRIMARY KEY ( logpath, run ))",
+			"CREATE INDEX IF NOT EXISTS reportsByBarcode ON reports ( barcode, rundate )",
+			"CREATE INDEX IF NOT EXISTS reportsByDate ON reports ( instrument, rundate )" ))
+		return connection
+
 class ReportHeader:
 	def __init__( self, instr ):
 		self._instr = instr
@@ -629,6 +2413,412 @@ class ReportHeader:
 			+  "Report Time: " + self._reportTime + "\n" \
 			+  "Instrument:  " + self._instr
 
+class ReportManifest( JsonIndex ):
+	def __init__( self, rptdir ):
+		# the entries in rptdir/manifest.json, and the ones this process
+		# recorded, which Save writes over what the file has by then
+		JsonIndex.__init__( self, rptdir + '/manifest.json' )
+
+	def Drop( self, logPath ):
+		# forget the entry recorded for logPath, the one saved is kept
+		self._new.pop( logPath, None )
+		self.Reload( logPath )
+
+	def IsCurrent( self, logPath ):
+		# a log is current when every file in its recorded chain still has
+		# the same size, and either the same mtime or the same content
+		entry = self._entries.get( logPath )
+		if( entry == None ):
+			return False
+
+		for path, size, mtime, digest in entry[ 'files' ]:
+			try:
+				st = os.stat( path )
+			except OSError:
+				return False
+			if( st.st_size != size ):
+				return False
+			if(( st.st_mtime != mtime ) and ( FileDigest( path ) != digest )):
+				return False
+
+		for path in entry[ 'outputs' ]:
+			if( not os.path.exists( path )):
+				return False
+		return True
+
+	def Outputs( self, logPath ):
+		entry = self._entries.get( logPath )
+		if( entry == None ):
+			return []
+		return entry[ 'outputs' ]
+
+	def Record( self, logPath, entry ):
+		self._Put( logPath, entry )
+
+	def Reload( self, logPath ):
+		# read the entry of logPath again, True when another process
+		# saved a different one since it was read
+		entry = self._Load( ).get( logPath )
+		changed = ( entry != self._entries.get( logPath ))
+		if( entry == None ):
+			self._entries.pop( logPath, None )
+		else:
+			self._entries[ logPath ] = entry
+		return changed
+
+class ReportRequestHandler( BaseHTTPRequestHandler ):
+	# a GET request to a ReportServer, answered with JSON
+
+	def do_GET( self ):
+		url = urlparse( self.path )
+		query = dict(( key, values[ -1 ] ) for key, values in parse_qs( url.query ).items( ))
+		status, body = self.server.Answer( url.path, query )
+		data = json.dumps( body, sort_keys=True ) + "\n"
+		self.send_response( status )
+		self.send_header( "Content-Type", "application/json" )
+		self.send_header( "Content-Length", str( len( data )))
+		self.end_headers( )
+		self.wfile.write( data )
+
+	def log_message( self, format, *args ):
+		# a Unix socket client has no address to log
+		print >> sys.stderr, "serve: " + format % args
+
+class ReportServer( HTTPServer ):
+	def __init__( self, config ):
+		# Answers the requests of --serve one at a time, so they share
+		# the resolver of the process and the chains planned for each log
+		# directory, by the files the directory had when it was planned.
+		self._config = config
+		self._plans = {}
+		self._started = time.time( )
+		self._counts = {}
+		self._errors = 0
+		address = config.Serve( )
+		if( isinstance( address, str )):
+			self.address_family = socket.AF_UNIX
+			self._Unlink( address )
+		HTTPServer.__init__( self, address, ReportRequestHandler )
+
+	def Answer( self, path, query ):
+		# the HTTP status and JSON body of a request
+		# counted by endpoint, the paths no endpoint answers as other
+		start = time.time( )
+		endpoint = path
+		try:
+			if( path == "/health" ):
+				status, body = 200, self._Health( )
+			elif( path == "/day" ):
+				status, body = 200, self._Day( query )
+			elif( path == "/report" ):
+				status, body = 200, self._Report( query )
+			else:
+				endpoint = "other"
+				raise LookupError( "no such request " + path )
+		except LookupError as detail:
+			status, body = 404, { "error": str( detail ) }
+		except ( ValueError, RuntimeError ) as detail:
+			status, body = 400, { "error": str( detail ) }
+		except Exception as detail:
+			print >> sys.stderr, traceback.format_exc().rstrip()
+			status, body = 500, { "error": str( detail ) }
+
+		if( status != 200 ):
+			self._errors += 1
+		count = self._counts.setdefault( endpoint, [ 0, 0.0 ] )
+		count[ 0 ] += 1
+		count[ 1 ] += time.time( ) - start
+		return status, body
+
+	def handle_error( self, request, client_address ):
+		# an interrupt while a request is answered stops the service
+		if( sys.exc_info( )[ 0 ] == KeyboardInterrupt ):
+			raise
+		HTTPServer.handle_error( self, request, client_address )
+
+	def server_bind( self ):
+		# a Unix socket has no host name or port to look up
+		if( self.address_family != socket.AF_UNIX ):
+			HTTPServer.server_bind( self )
+			return
+		TCPServer.server_bind( self )
+		self.server_name = "localhost"
+		self.server_port = 0
+
+	def server_close( self ):
+		HTTPServer.server_close( self )
+		if( self.address_family == socket.AF_UNIX ):
+			os.unlink( self.server_address )
+
+	def _Chain( self, config, logFname ):
+		# the chain of the log directory logFname is in
+		for chain in self._Plan( config ):
+			if( logFname in chain ):
+				return chain
+		raise LookupError( "no log file " + config.LogDir( ) + "/" + logFname )
+
+	def _Day( self, query ):
+		config = self._GetDayConfig( query )
+		status = { "instrument": config.GetInstr( ), "date": config.GetLogDate( ).strftime( '%m/%d/%Y' ),
+			"logdir": config.LogDir( ), "exists": os.path.isdir( config.LogDir( )) }
+		if( status[ "exists" ] ):
+			chains = self._Plan( config )
+			manifest = ReportManifest( config.RptDir( ))
+			current = len([ chain for chain in chains if manifest.IsCurrent( config.LogDir( ) + "/" + chain[ 0 ] )])
+			status[ "logs" ] = sum( len( chain ) for chain in chains )
+			status[ "chains" ] = len( chains )
+			status[ "current" ] = current
+			status[ "pending" ] = len( chains ) - current
+		status[ "runs" ], status[ "failed" ] = GetReportIndex( config ).CountRuns( config.LogDir( ))
+		return status
+
+	def _Evaluate( self, logPath, runs ):
+		# the records of the runs of the log at logPath, of every run when
+		# runs is None, with the pdf report of each written again
+		config = self._config.GetLogDirConfig( os.path.dirname( logPath ))
+		logFname = os.path.basename( logPath )
+		records = []
+		for fname, run, last, window, mm, userStartIndex in PlanRuns( config, self._Chain( config, logFname )):
+			if(( fname != logFname ) or (( runs != None ) and ( run not in runs ))):
+				continue
+			report = InitReport( config, window, fname, run, mm, userStartIndex )
+			record = report.GetRecord( )
+			pdfPath = None
+			if( config.Format( ) == 'pdf' ):
+				if( report.Error( ) == None ):
+					pdfPath = WritePdfReport( config, fname, report, last )[ 0 ]
+				GetReportIndex( config ).Add( mm.Path( ), record, pdfPath )
+			record[ "pdf" ] = pdfPath
+			records.append( record )
+		return records
+
+	def _GetDayConfig( self, query ):
+		if( "date" in query ):
+			return self._config.GetDayConfig( ParseDate( query[ "date" ] ))
+		return self._config
+
+	def _Health( self ):
+		requests = dict(( path, { "requests": count[ 0 ], "ms": 1000.0 * count[ 1 ] / count[ 0 ] })
+			for path, count in self._counts.items( ))
+		return { "status": "ok", "pid": os.getpid( ), "uptime": time.time( ) - self._started,
+			"requests": requests, "errors": self._errors, "plans": len( self._plans ),
+			"resolver": GetLogResolver( self._config ).GetCounts( ) }
+
+	def _Plan( self, config ):
+		# the chains of the log directory, planned again when a file in it
+		# changed since they were planned
+		logDir = config.LogDir( )
+		if( not os.path.isdir( logDir )):
+			raise LookupError( "no log directory " + logDir )
+		files = []
+		for fname in sorted( os.listdir( logDir )):
+			st = os.stat( logDir + "/" + fname )
+			files.append(( fname, st.st_size, st.st_mtime ))
+		plan = self._plans.get( logDir )
+		if(( plan == None ) or ( plan[ 0 ] != files )):
+			plan = ( files, PlanLogDir( config ))
+			self._plans[ logDir ] = plan
+		return plan[ 1 ]
+
+	def _Report( self, query ):
+		# the runs of a barcode that reports.db records, or of a log file,
+		# evaluated again from the logs as they are now
+		if( "barcode" in query ):
+			logRuns = GetReportIndex( self._config ).LogRuns( self._config.GetInstr( ), query[ "barcode" ])
+			if( len( logRuns ) == 0 ):
+				raise LookupError( "no runs recorded for " + query[ "barcode" ])
+		elif( "log" in query ):
+			logPath = query[ "log" ]
+			if( not logPath.startswith( "/" )):
+				logPath = self._GetDayConfig( query ).LogDir( ) + "/" + logPath
+			logRuns = [( logPath, None )]
+		else:
+			raise ValueError( "missing argument (barcode or log)" )
+
+		resolver = GetLogResolver( self._config )
+		if( resolver.GetCounts( )[ "logs" ] > ServeMaxLogs ):
+			CloseLogResolver( )
+		else:
+			resolver.Refresh( )
+
+		runs = OrderedDict( )
+		for logPath, run in logRuns:
+			if( run == None ):
+				runs[ logPath ] = None
+			else:
+				runs.setdefault( logPath, set( )).add( run )
+		records = []
+		try:
+			for logPath, logPathRuns in runs.items( ):
+				records += self._Evaluate( logPath, logPathRuns )
+		finally:
+			GetReportIndex( self._config ).Save( )
+			GetLogRunIndex( self._config ).Save( )
+		return { "runs": records }
+
+	def _Unlink( self, path ):
+		# remove the socket a server that is gone left behind, any other
+		# file at path is left alone
+		if( not os.path.exists( path )):
+			return
+		if( not stat.S_ISSOCK( os.stat( path ).st_mode )):
+			raise RuntimeError( "invalid argument (serve), " + path + " is not a socket" )
+		probe = socket.socket( socket.AF_UNIX )
+		try:
+			probe.connect( path )
+		except socket.error:
+			os.unlink( path )
+			return
+		finally:
+			probe.close( )
+		raise RuntimeError( "invalid argument (serve), another server answers on " + path )
+
+class ReportWriter:
+	def __init__( self, depth ):
+		# Writes the pdf reports handed to Write( ), and their links, in
+		# order on a thread of its own while the next runs are evaluated,
+		# Write( ) waits while depth of them are waiting. The error of a
+		# report that can't be written is raised by the next Write( ) or
+		# Close( ), and the reports after it are not written.
+		self._queue = Queue( depth )
+		self._error = None
+		self._failed = False
+		self._thread = threading.Thread( target=self._Write )
+		self._thread.daemon = True
+		self._thread.start( )
+
+	def Close( self ):
+		# wait for the reports handed over so far to be written
+		self._Put( None )
+		while( self._thread.is_alive( )):
+			self._thread.join( 0.1 )
+		self._Raise( )
+
+	def Write( self, config, logFname, report, last ):
+		# the paths WritePdfReport( ) returns, the files are written later
+		self._Raise( )
+		self._Put(( config, logFname, report, last ))
+		return GetPdfReportPaths( config, logFname, report, last )
+
+	def _Put( self, item ):
+		# the wait has a timeout so that ctrl-c is seen
+		while( True ):
+			try:
+				self._queue.put( item, True, 1 )
+				return
+			except Full:
+				pass
+
+	def _Raise( self ):
+		if( self._error != None ):
+			error = self._error
+			self._error = None
+			raise error[ 0 ], error[ 1 ], error[ 2 ]
+
+	def _Write( self ):
+		while( True ):
+			item = self._queue.get( )
+			if( item == None ):
+				return
+			if( self._failed ):
+				continue
+			try:
+				WritePdfReport( *item )
+			except Exception:
+				self._error = sys.exc_info( )
+				self._failed = True
+
+class RunProfile:
+	def __init__( self ):
+		# the records of the log files reported since TakeRecords was
+		# last called, by log file name in the order they were begun,
+		# and the one the stages are timed for now
+		self._records = OrderedDict( )
+		self._current = None
+		self._start = time.time( )
+
+		# the totals of the records emitted so far, the stages timed
+		# outside of any log file's record are added here directly
+		self._totals = self._NewRecord( None )
+		self._logs = 0
+
+	def Begin( self, logFname ):
+		# time the stages that follow for logFname
+		self._current = self._records.get( logFname )
+		if( self._current == None ):
+			self._current = self._NewRecord( logFname )
+			self._records[ logFname ] = self._current
+
+	def Emit( self, records ):
+		# print one JSON line per log file, and add them to the totals
+		for record in records:
+			print >> sys.stderr, json.dumps( record, sort_keys=True )
+			self._logs += 1
+			self._Add( self._totals, record )
+
+	def Opened( self, nbytes ):
+		# a log file was opened and nbytes of it were scanned
+		record = self._GetRecord( )
+		record[ "filesOpened" ] += 1
+		record[ "bytesScanned" ] += nbytes
+
+	def PrintSummary( self ):
+		totals = self._totals
+		elapsed = time.time( ) - self._start
+		print >> sys.stderr, "profile: %d log files, %d runs, %d files opened, %.1f MB scanned, chain depth %d, %.3f s" % (
+			self._logs, totals[ "runs" ], totals[ "filesOpened" ],
+			totals[ "bytesScanned" ] / ( 1024.0 * 1024.0 ), totals[ "chainDepth" ], elapsed )
+		print >> sys.stderr, "  %-32s %8s %10s %7s" % ( "stage", "calls", "seconds", "share" )
+		for name, seconds in sorted( totals[ "seconds" ].items( ), key=lambda item: -item[ 1 ] ):
+			print >> sys.stderr, "  %-32s %8d %10.4f %6.1f%%" % (
+				name, totals[ "calls" ][ name ], seconds, 100.0 * seconds / max( elapsed, 1e-9 ))
+
+	def Run( self, chainDepth ):
+		# a run was reported, after following chainDepth log files
+		record = self._GetRecord( )
+		record[ "runs" ] += 1
+		record[ "chainDepth" ] = max( record[ "chainDepth" ], chainDepth )
+
+	@contextlib.contextmanager
+	def Stage( self, name, logFname = None ):
+		# with logFname the stage is timed for that log file, as the
+		# writer thread does while this one has begun the next log
+		start = time.time( )
+		try:
+			yield
+		finally:
+			if( logFname == None ):
+				record = self._GetRecord( )
+			else:
+				record = self._records.get( logFname, self._totals )
+			record[ "seconds" ][ name ] = record[ "seconds" ].get( name, 0.0 ) + time.time( ) - start
+			record[ "calls" ][ name ] = record[ "calls" ].get( name, 0 ) + 1
+
+	def TakeRecords( self ):
+		# the records begun since the last call, they are handed to Emit,
+		# possibly by another process
+		records = self._records.values( )
+		self._records = OrderedDict( )
+		self._current = None
+		return records
+
+	def _Add( self, totals, record ):
+		for key in ( "runs", "filesOpened", "bytesScanned" ):
+			totals[ key ] += record[ key ]
+		totals[ "chainDepth" ] = max( totals[ "chainDepth" ], record[ "chainDepth" ])
+		for name, seconds in record[ "seconds" ].items( ):
+			totals[ "seconds" ][ name ] = totals[ "seconds" ].get( name, 0.0 ) + seconds
+			totals[ "calls" ][ name ] = totals[ "calls" ].get( name, 0 ) + record[ "calls" ][ name ]
+
+	def _GetRecord( self ):
+		if( self._current == None ):
+			return self._totals
+		return self._current
+
+	def _NewRecord( self, logFname ):
+		return { "log": logFname, "runs": 0, "seconds": {}, "calls": {},
+			"bytesScanned": 0, "filesOpened": 0, "chainDepth": 0 }
+
 class RunTimeConfig:
 	def __init__( self ):
 		parser = OptionParser()
@@ -636,139 +2826,1466 @@ class RunTimeConfig:
 		parser.add_option( "-d", "--logdate", dest="logdate", help="log date" )
 		parser.add_option( "-l", "--logdir", dest="logdir", help="log file directory" )
 		parser.add_option( "-r", "--rptdir", dest="rptdir", help="report directory" )
+		parser.add_option( "-j", "--jobs", dest="jobs", type="int", default=1, help="number of worker processes" )
+		parser.add_option( "-f", "--force", dest="force", action="store_true", default=False, help="ignore the manifest" )
+		parser.add_option( "--format", dest="format", default="pdf", choices=( "pdf", "json", "csv" ), help="report format (pdf, json or csv)" )
+		parser.add_option( "--maxmapped", dest="maxmapped", type="int", default=16, help="most log files mapped at once" )
+		parser.add_option( "--mapsize", dest="mapsize", type="int", help="largest log file mapped (MB)" )
+		parser.add_option( "--profile", dest="profile", action="store_true", default=False, help="time the report stages" )
+		parser.add_option( "--stagedir", dest="stagedir", help="local log file stage directory" )
+		parser.add_option( "--stagesize", dest="stagesize", type="int", default=4096, help="stage directory budget (MB)" )
+		parser.add_option( "--summarysize", dest="summarysize", type="int", default=0, help="log summary budget (MB)" )
+		parser.add_option( "--query", dest="query", action="store_true", default=False, help="list the recorded runs" )
+		parser.add_option( "--barcode", dest="barcode", help="query runs of this barcode" )
+		parser.add_option( "--failed", dest="failed", action="store_true", default=False, help="query failed runs" )
+		parser.add_option( "--from", dest="fromdate", help="query runs on or after this date" )
+		parser.add_option( "--to", dest="todate", help="query runs on or before this date" )
+		parser.add_option( "--backfill", dest="backfill", help="report every day of this date range" )
+		parser.add_option( "--logroot", dest="logroot", default="/mnt/lancer/upload/DailyInstrumentData", help="instrument directory root" )
+		parser.add_option( "--checkpoint", dest="checkpoint", default="~/.dailyInitReport_backfill.json", help="backfill checkpoint file" )
+		parser.add_option( "--logtree", dest="logtree", help="ucm_logs tree of the instrument" )
+		parser.add_option( "--follow", dest="follow", action="store_true", default=False, help="report runs as they end" )
+		parser.add_option( "--interval", dest="interval", type="float", default=5.0, help="follow interval (seconds)" )
+		parser.add_option( "--poll", dest="poll", action="store_true", default=False, help="follow without inotify" )
+		parser.add_option( "--pipeline", dest="pipeline", type="int", default=0, help="chains read ahead" )
+		parser.add_option( "--serve", dest="serve", help="Unix socket path or localhost port to serve on" )
+		parser.add_option( "--shard", dest="shard", action="store_true", default=False, help="share the chains out through leases" )
+		parser.add_option( "--leasetime", dest="leasetime", type="float", default=300.0, help="lease expiry (seconds)" )
 
 		(options, args) = parser.parse_args()
 
-		# handle instrument argument
+		# handle instrument argument, a backfill takes a list of them
 		if options.instr == None:
 			raise RuntimeError( "missing argument (instr)" )
-		self._instr = options.instr
-
-		# handle log date argument
+		self._instrs = options.instr.split( "," )
+		if(( len( self._instrs ) > 1 ) and ( options.backfill == None )):
+			raise RuntimeError( "invalid argument (instr)" )
+
+		# handle backfill date range
+		self._backfill = None
+		if options.backfill != None:
+			if options.logdir != None:
+				raise RuntimeError( "invalid argument (logdir), a backfill reads the days under logroot" )
+			first, last = options.backfill.split( "-" )
+			self._backfill = ( ParseDate( first ), ParseDate( last ))
+			if self._backfill[ 0 ] > self._backfill[ 1 ]:
+				raise RuntimeError( "invalid argument (backfill)" )
+		self._checkpoint = os.path.expanduser( options.checkpoint )
+
+		# handle following the logs as they are written
+		if(( options.follow ) and ( options.backfill != None )):
+			raise RuntimeError( "invalid argument (follow), a backfill reads finished days" )
+		if options.interval <= 0:
+			raise RuntimeError( "invalid argument (interval)" )
+		self._follow = options.follow
+		self._interval = options.interval
+		self._poll = options.poll
+
+		# handle log date argument, a follow starts from today
 		yesterday = date.today() - timedelta(1)
-		yyyy = yesterday.strftime('%Y')
-		mm = yesterday.strftime('%m')
-		dd = yesterday.strftime('%d')
-
+		if options.follow:
+			yesterday = date.today()
 		if options.logdate != None:
-			mm = options.logdate[0:2]
-			dd = options.logdate[3:5]
-			yyyy = options.logdate[6:]
+			yesterday = ParseDate( options.logdate )
+		self._logdateOption = options.logdate
+
+		# the log and report directories follow from the instrument and
+		# day, unless they are given
+		self._logroot = options.logroot
+		self._logtreeOption = options.logtree
+		self._logdirOption = options.logdir
+		self._rptdirOption = options.rptdir
+		self._SetUnit( self._instrs[ 0 ], yesterday )
+
+		# handle number of worker processes
+		if options.jobs < 1:
+			raise RuntimeError( "invalid argument (jobs)" )
+		self._jobs = options.jobs
+		self._force = options.force
+		self._format = options.format
+
+		# handle the limit on mapped log files
+		if options.maxmapped < 1:
+			raise RuntimeError( "invalid argument (maxmapped)" )
+		self._maxmapped = options.maxmapped
+		if(( options.mapsize != None ) and ( options.mapsize < 1 )):
+			raise RuntimeError( "invalid argument (mapsize)" )
+		self._mapsize = options.mapsize
+		self._profile = options.profile
+
+		# handle the local stage for the log files
+		if options.stagesize < 1:
+			raise RuntimeError( "invalid argument (stagesize)" )
+		self._stagedir = options.stagedir
+		self._stagesize = options.stagesize
+
+		# handle the log summaries
+		if options.summarysize < 0:
+			raise RuntimeError( "invalid argument (summarysize)" )
+		self._summarysize = options.summarysize
+
+		# handle the reader and writer threads
+		if options.pipeline < 0:
+			raise RuntimeError( "invalid argument (pipeline)" )
+		self._pipeline = options.pipeline
+
+		# handle sharing the chains out through leases, which only pdf
+		# reports recorded in the manifest can be
+		if(( options.shard ) and (( options.format != 'pdf' ) or ( options.follow ))):
+			raise RuntimeError( "invalid argument (shard), only pdf reports of finished logs are shared out" )
+		if options.leasetime <= 0:
+			raise RuntimeError( "invalid argument (leasetime)" )
+		self._shard = options.shard
+		self._leasetime = options.leasetime
+
+		# handle the report service, a path is a Unix socket
+		self._serve = options.serve
+		if options.serve != None:
+			if(( options.follow ) or ( options.backfill != None ) or ( options.query )):
+				raise RuntimeError( "invalid argument (serve), a service answers requests on its own" )
+			if options.serve.isdigit( ):
+				self._serve = ( "127.0.0.1", int( options.serve ))
+
+		# handle the report query, dates are mm/dd/yyyy like the log date
+		self._query = options.query
+		self._queryBarcode = options.barcode
+		self._queryFailed = options.failed
+		dates = []
+		for name, mmddyyyy in (( "from", options.fromdate ), ( "to", options.todate )):
+			if mmddyyyy == None:
+				dates.append( None )
+				continue
+			try:
+				dates.append( time.strftime( "%Y-%m-%d", time.strptime( mmddyyyy, "%m/%d/%Y" )))
+			except ValueError:
+				raise RuntimeError( "invalid argument (" + name + ")" )
+		self._queryFrom, self._queryTo = dates
+		if(( None not in dates ) and ( self._queryFrom > self._queryTo )):
+			raise RuntimeError( "invalid argument (from), after --to" )
 
-		# handle log directory (input)
-		if options.logdir != None:
-			self._logdir = options.logdir 
-		else:
-			self._logdir = '/mnt/lancer/upload/DailyInstrumentData/' + self._instr + '/gservlog/ucm_logs/' + self._instr + '_' + yyyy + mm + '/' + dd 
+	def Force( self ):
+		return self._force
 
-		# handle report directory (output)
-		if options.rptdir != None:
-			self._rptdir = options.rptdir
-		else:
-			self._rptdir = '/mnt/lancer/upload/DailyInstrumentData/' + self._instr + '/reports'
+	def Format( self ):
+		return self._format
+
+	def Jobs( self ):
+		return self._jobs
+
+	def LeaseTime( self ):
+		return self._leasetime
 
 	def LogDir( self ):
 		return self._logdir
 
+	def LogTree( self ):
+		# the ucm_logs tree of the instrument, None when --logdir is
+		# given without --logtree
+		if( self._logtreeOption != None ):
+			return self._logtreeOption
+		if( self._logdirOption != None ):
+			return None
+		return self._logroot + '/' + self._instr + '/gservlog/ucm_logs'
+
+	def MapSize( self ):
+		# in bytes, None when every log is mapped
+		if( self._mapsize == None ):
+			return None
+		return self._mapsize * 1024 * 1024
+
+	def MaxMapped( self ):
+		return self._maxmapped
+
+	def Pipeline( self ):
+		return self._pipeline
+
+	def Profile( self ):
+		return self._profile
+
+	def Query( self ):
+		return self._query
+
+	def QueryBarcode( self ):
+		return self._queryBarcode
+
+	def QueryFailed( self ):
+		return self._queryFailed
+
+	def QueryFrom( self ):
+		return self._queryFrom
+
+	def QueryTo( self ):
+		return self._queryTo
+
 	def RptDir( self ):
 		return self._rptdir
 
+	def Serve( self ):
+		# the address to serve on, None when not serving
+		return self._serve
+
+	def Shard( self ):
+		return self._shard
+
+	def StageDir( self ):
+		return self._stagedir
+
+	def StageSize( self ):
+		return self._stagesize
+
+	def SummarySize( self ):
+		return self._summarysize
+
+	def Backfill( self ):
+		return self._backfill != None
+
+	def Checkpoint( self ):
+		return self._checkpoint
+
+	def Follow( self ):
+		return self._follow
+
+	def FollowToday( self ):
+		# move a follow on to today's log directory, unless its log
+		# directory or date was given, True when it moved
+		if(( self._logdirOption != None ) or ( self._logdateOption != None ) or ( self._logdate == date.today( ))):
+			return False
+		self._SetUnit( self._instr, date.today( ))
+		return True
+
+	def Interval( self ):
+		return self._interval
+
+	def Poll( self ):
+		return self._poll
+
+	def GetDayConfig( self, logdate ):
+		# a copy of the configuration for another day of the instrument,
+		# there is no other day's directory when --logdir is given
+		if self._logdirOption != None:
+			raise RuntimeError( "invalid argument (date), the log directory is given by --logdir" )
+		unit = copy.copy( self )
+		unit._SetUnit( self._instr, logdate )
+		return unit
+
 	def GetInstr( self ):
 		return self._instr
 
-def GetRptInfoFromFname( logFname ):
-	bname = string.split( logFname, '.' )
-	return string.split( bname, '_' )
+	def GetLogDate( self ):
+		return self._logdate
+
+	def GetLogDirConfig( self, logdir ):
+		# a copy of the configuration that reads the logs of logdir
+		unit = copy.copy( self )
+		unit._logdir = logdir
+		return unit
+
+	def GetUnitName( self ):
+		return self._instr + " " + self._logdate.strftime( '%m/%d/%Y' )
+
+	def GetUnits( self ):
+		# a copy of the configuration for each day of the backfill and
+		# instrument, in date order
+		units = []
+		day, last = self._backfill
+		while( day <= last ):
+			for instr in self._instrs:
+				unit = copy.copy( self )
+				unit._SetUnit( instr, day )
+				units.append( unit )
+			day += timedelta( 1 )
+		return units
+
+	def _SetUnit( self, instr, logdate ):
+		self._instr = instr
+		self._logdate = logdate
+		yyyy = logdate.strftime('%Y')
+		mm = logdate.strftime('%m')
+		dd = logdate.strftime('%d')
 
-def ProcessLogFile( logFname, config ):
-	fullPathLogFname = config.LogDir( ) + "/" + logFname
-	with open( fullPathLogFname, 'r' ) as f:
-		try:
-			mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
-			loc = []
-			loc.append( mm.rfind( ':USER: Start', 0 ))
-			loc.append( mm.rfind( ':USER: Restart', 0 ))
-			loc.append( mm.rfind( ':USER: Run', 0 ))
-			userStartIndex = max( loc )
-
-			if( userStartIndex > -1 ):
-				fig = pyplot.figure( 1, figsize=(8.5, 11), dpi=100, facecolor='w' )
-				fig.clear()
-
-				rptTitle = "VisionGate CCT QC Report"
-				print "\n", rptTitle
-				fig.text( 0.10, 0.88, rptTitle,  ha='left', va='top' )
-
-				rptHeadings = ReportHeader( config.GetInstr( ))
-				print rptHeadings.GetReport()
-				fig.text( 0.10, 0.84, rptHeadings.GetReport(), ha='left', va='top' )
-
-				barcodeData = BarcodeData( mm, userStartIndex )
-				print barcodeData.GetReport()
-				fig.text( 0.10, 0.79, barcodeData.GetReport(), ha='left', va='top' )
-
-				print '\nProcesses:'
-				fig.text( 0.10, 0.75, 'Processes:', ha='left', va='top' )
-
-				findCapillary = FindCapillary( mm, userStartIndex )
-				print findCapillary.GetReport()
-				fig.text( 0.14, 0.72, findCapillary.GetReport(), ha='left', va='top' )
-
-				illumCamCalib = IlluminationCameraCalibration( mm, userStartIndex )
-				print illumCamCalib.GetIllumReport()
-				print illumCamCalib.GetCameraReport()
-				fig.text( 0.14, 0.70, illumCamCalib.GetIllumReport(), ha='left', va='top' )
-				fig.text( 0.14, 0.68, illumCamCalib.GetCameraReport(), ha='left', va='top' )
-
-				pvTest = PressureVelocityTest( config, mm, userStartIndex )
-				print pvTest.GetReport()
-				fig.text( 0.14, 0.66, pvTest.GetReport(), ha='left', va='top' )
-
-				# locating the capillary calibration status involves
-				# following some number of log files, which involves
-				# closing one memory map, and opening another
-				capCal = CapillaryCalibration( config, pvTest.GetMMap(), pvTest.GetIndex())
-				print capCal.GetReport()
-				fig.text( 0.14, 0.64, capCal.GetReport(), ha='left', va='top' )
-
-				# locating the data collection started information
-				# also involves following some number of log files
-				dataCol = DataCollection( config, capCal.GetMMap( ), capCal.GetIndex())
-				print dataCol.GetReport()
-				fig.text( 0.14, 0.62, dataCol.GetReport(), ha='left', va='top' )
-
-				# save the report with a filename that sorts by data collection date
-				nameByDate = string.split( logFname, '.' )[0] + '_' + barcodeData.Barcode()
-				if(( findCapillary._capillaryFound == True ) and
-					( illumCamCalib._illuminationCalibrationPassed == True ) and
-					( pvTest._pressureVelocityTestPassed == True ) and
-					( capCal._capillaryCalibrationPassed == True ) and
-					( dataCol._dataCollectionStarted == True )):
-					ccode = 'p'
-				else:
-					ccode = 'f'
+		# handle log directory (input)
+		if self._logdirOption != None:
+			self._logdir = self._logdirOption 
+		else:
+			self._logdir = self._logroot + '/' + self._instr + '/gservlog/ucm_logs/' + self._instr + '_' + yyyy + mm + '/' + dd 
 
-				fullPathByDate = config.RptDir( ) + '/by_date/' + nameByDate + '_' + ccode + '.pdf'
-				fig.savefig( fullPathByDate, format='pdf' )
+		# handle report directory (output)
+		if self._rptdirOption != None:
+			self._rptdir = self._rptdirOption
+		else:
+			self._rptdir = self._logroot + '/' + self._instr + '/reports'
+
+class RunWindow:
+	def __init__( self, resolver, endLog, endIndex ):
+		# A run lasts from its :USER: start entry up to the start entry of
+		# the next run in the chain, or to the end of the chain for the
+		# last one. The stages search for their markers before End( ) in
+		# each log, and follow the chain no further than endLog.
+		self._resolver = resolver
+		self._endLog = endLog
+		self._endIndex = endIndex
+		self._reached = set( )
+
+	def Depth( self ):
+		# the number of logs the run was followed into
+		return len( self._reached )
+
+	def End( self, mm ):
+		if(( self._endLog != None ) and ( mm.Path( ) == self._endLog.Path( ))):
+			return self._endIndex
+		return len( mm )
+
+	def Next( self, mm ):
+		if(( self._endLog != None ) and ( mm.Path( ) == self._endLog.Path( ))):
+			return None
+		nextLog = self._resolver.Next( mm )
+		if( nextLog != None ):
+			self._reached.add( nextLog.Path( ))
+		return nextLog
+
+class SparseLog( IndexedLog ):
+	def __init__( self, path, blocks, summary = None ):
+		# A log that can't be mapped, read once from blocks, the strings
+		# its text is delivered in, or restored from the Summary( ) of
+		# the log. It keeps the marker index of a mapped log and, of its
+		# text, only the lines holding a marker, so the stages find and
+		# slice the entries they look for as they would in a mapped log,
+		# and everything else in the file reads as missing.
+		self._path = path
+		self._text = SparseText( )
+		self._offsets = [ array( 'l' ) for marker in LogMarkers ]
+		self._slots = {}
+		for slot, marker in enumerate( LogMarkers ):
+			self._slots[ marker ] = slot
+		self._lineStamps = {}
+		if( summary != None ):
+			self._size, offsets, starts, lines = summary
+			for slot, data in enumerate( offsets ):
+				self._offsets[ slot ].fromstring( data )
+			self._text.Extend( array( 'l', starts ), lines )
+			return
 
-				# save a hard link to the report file, and give the hard link a name that sorts on barcode
-				nameByBcode = barcodeData.Barcode( ) + '_' + string.split( logFname, '.' )[0] 
-				fullPathByBcode = config.RptDir( ) + '/by_bcode/' + nameByBcode + '_' + ccode + '.pdf'
-				os.link( fullPathByDate, fullPathByBcode )
+		# Only complete lines are scanned, the rest of a block is carried
+		# over to the next one. What is carried starts with the newline
+		# ending the last scanned line, which is where a kept line starts.
+		base = 0
+		pending = ""
+		for block in blocks:
+			pending += block
+			end = pending.rfind( "\n" ) + 1
+			if( end > 1 ):
+				self._Scan( pending, base, end )
+				base += end - 1
+				pending = pending[ end - 1 : ]
+		self._Scan( pending, base, len( pending ))
+		self._size = base + len( pending )
+
+	def LineBreak( self, index ):
+		return self._text.LineBreak( index )
+
+	def Summary( self ):
+		starts, lines = self._text.Lines( )
+		return ( self._size, [ offsets.tostring( ) for offsets in self._offsets ], starts.tostring( ), lines )
+
+	def close( self ):
+		pass
+
+	def _Map( self ):
+		return self._text
+
+	def _Scan( self, text, base, end ):
+		# index the markers in text[ : end ], text starts at offset base
+		# of the log, and keep the lines they are on
+		lineEnd = -1
+		for offset, slot in FindLogMarkers( text, 0, end ):
+			self._offsets[ slot ].append( base + offset )
+			if( offset > lineEnd ):
+				lineStart = max( text.rfind( "\n", 0, offset ), 0 )
+				lineEnd = text.find( "\n", offset + len( LogMarkers[ slot ]))
+				if( lineEnd == -1 ):
+					lineEnd = len( text ) - 1
+				self._text.Add( base + lineStart, text[ lineStart : lineEnd + 1 ] )
+
+class SparseText:
+	def __init__( self ):
+		# the kept lines of a SparseLog by log offset, each line is kept
+		# with the newline before it, which LineBreak( ) points at
+		self._starts = array( 'l' )
+		self._lines = []
+
+	def Add( self, start, line ):
+		self._starts.append( start )
+		self._lines.append( line )
+
+	def Extend( self, starts, lines ):
+		self._starts.extend( starts )
+		self._lines.extend( lines )
+
+	def Lines( self ):
+		# the offsets of the kept lines and the lines
+		return ( self._starts, self._lines )
+
+	def LineBreak( self, index ):
+		# mm.rfind( "\n", 0, index ) for an index on a kept line
+		i = self._Line( index - 1 )
+		if(( i == -1 ) or ( self._lines[ i ][ 0 ] != "\n" )):
+			return -1
+		return self._starts[ i ]
+
+	def find( self, sub, start = 0, end = None ):
+		# finds sub on the kept line start is on, a line is never searched
+		# past its end
+		i = self._Line( start )
+		if( i == -1 ):
+			return -1
+		lineStart = self._starts[ i ]
+		lineEnd = lineStart + len( self._lines[ i ] )
+		if(( end == None ) or ( end > lineEnd )):
+			end = lineEnd
+		index = self._lines[ i ].find( sub, start - lineStart, end - lineStart )
+		if( index == -1 ):
+			return -1
+		return lineStart + index
+
+	def rfind( self, sub, start = 0, end = None ):
+		# rfinds sub on the kept line end is on
+		if( end == None ):
+			return -1
+		i = self._Line( end - 1 )
+		if( i == -1 ):
+			return -1
+		lineStart = self._starts[ i ]
+		index = self._lines[ i ].rfind( sub, max( start - lineStart, 0 ), end - lineStart )
+		if( index == -1 ):
+			return -1
+		return lineStart + index
+
+	def __getitem__( self, key ):
+		# a slice or character of a kept line, a slice never extends past
+		# the line its start is on
+		if( isinstance( key, slice )):
+			i = self._Line( key.start )
+			if( i == -1 ):
+				return ""
+			lineStart = self._starts[ i ]
+			if( key.stop == None ):
+				return self._lines[ i ][ key.start - lineStart : ]
+			return self._lines[ i ][ key.start - lineStart : key.stop - lineStart ]
+
+		i = self._Line( key )
+		if( i == -1 ):
+			raise IndexError( "log offset not kept" )
+		return self._lines[ i ][ key - self._starts[ i ]]
+
+	def _Line( self, index ):
+		# the kept line holding index, the last of two lines sharing the
+		# newline at index
+		i = bisect_right( self._starts, index ) - 1
+		if(( i >= 0 ) and ( index < self._starts[ i ] + len( self._lines[ i ] ))):
+			return i
+		return -1
+
+class WorkLeases:
+	def __init__( self, rptdir, leaseTime ):
+		# The lease files in rptdir/leases, each one held by the process
+		# that created it, whose name and host it holds, until it removes
+		# it or leaves it unrenewed for leaseTime seconds. The leases this
+		# process holds are renewed by a thread of their own, until one
+		# names another process that took it over.
+		self._dir = rptdir + "/" + LeaseDirName
+		self._leaseTime = leaseTime
+		self._token = "%s %d" % ( socket.gethostname( ), os.getpid( ))
+		self._held = {}
+		self._lock = threading.Lock( )
+		self._stop = threading.Event( )
+		if( not os.path.isdir( self._dir )):
+			try:
+				os.makedirs( self._dir )
+			except OSError:
+				if( not os.path.isdir( self._dir )):
+					raise
+		self._thread = threading.Thread( target=self._Renew )
+		self._thread.daemon = True
+		self._thread.start( )
+
+	def Claim( self, name ):
+		# True when this process holds the lease of name now, an expired
+		# lease is taken over
+		path = self._dir + "/" + name
+		while( True ):
+			try:
+				fd = os.open( path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0644 )
+			except OSError as detail:
+				if( detail.errno != errno.EEXIST ):
+					raise
+				if( not self._Expired( path )):
+					return False
+				self._Break( path )
+				continue
+			try:
+				os.write( fd, self._token + "\n" )
+			finally:
+				os.close( fd )
+			with self._lock:
+				self._held[ name ] = path
+			return True
+
+	def Close( self ):
+		# stop renewing, and give up every lease still held
+		self._stop.set( )
+		self._thread.join( )
+		for name in self._held.keys( ):
+			self.Release( name )
+
+	@contextlib.contextmanager
+	def Hold( self, name ):
+		# the lease of name, waited for, for the duration of the block
+		while( not self.Claim( name )):
+			time.sleep( LeaseWait )
+		try:
+			yield
+		finally:
+			self.Release( name )
+
+	def Holds( self, name ):
+		# True while this process holds the lease of name
+		with self._lock:
+			return name in self._held
+
+	def Release( self, name ):
+		with self._lock:
+			path = self._held.pop( name, None )
+		if(( path != None ) and ( self._Holder( path ) == self._token )):
+			try:
+				os.unlink( path )
+			except OSError:
+				pass
+
+	def _Break( self, path ):
+		# move an expired lease away, only one of the processes that find
+		# it expired moves it, and one that moves a lease renewed or made
+		# again meanwhile puts it back
+		stale = GetTempPath( path )
+		try:
+			os.rename( path, stale )
+		except OSError:
+			return
+		try:
+			if( not self._Expired( stale )):
+				os.link( stale, path )
+		except OSError:
+			pass
+		finally:
+			os.unlink( stale )
+
+	def _Expired( self, path ):
+		try:
+			return os.stat( path ).st_mtime + self._leaseTime < time.time( )
+		except OSError:
+			return True
+
+	def _Holder( self, path ):
+		try:
+			with open( path, 'r' ) as f:
+				return f.read( ).strip( )
+		except IOError:
+			return None
+
+	def _Renew( self ):
+		while( not self._stop.wait( self._leaseTime / 4.0 )):
+			with self._lock:
+				held = self._held.items( )
+			for name, path in held:
+				if( self._Holder( path ) != self._token ):
+					# broken and taken over, the lease is the other
+					# process's to renew, and the work its to do
+					with self._lock:
+						if( self._held.get( name ) == path ):
+							del self._held[ name ]
+					continue
+				try:
+					os.utime( path, None )
+				except OSError:
+					pass
+
+def ClaimChains( config, chains, manifest, leases, slots ):
+	# The chains this process holds the lease of, in order, with the
+	# reports of each one dropped before it is reported again. A chain
+	# another process holds, or reported since the manifest was read, is
+	# skipped. With slots, one is taken before each chain is claimed.
+	for chain in chains:
+		headPath = config.LogDir( ) + "/" + chain[ 0 ]
+		if( slots != None ):
+			slots.acquire( )
+		claimed = leases.Claim( GetChainLeaseName( headPath ))
+		if( claimed ):
+			changed = manifest.Reload( headPath )
+			if(( changed or ( not config.Force( ))) and manifest.IsCurrent( headPath )):
+				leases.Release( GetChainLeaseName( headPath ))
+				claimed = False
+		if( not claimed ):
+			if( slots != None ):
+				slots.release( )
+			continue
+		DropChainReports( config, manifest, chain )
+		yield chain
+
+def CloseLogResolver( ):
+	# forget the logs the resolver holds, a new one is made on next use
+	global logResolver
+	if( logResolver != None ):
+		logResolver.Close( )
+		logResolver = None
+
+def CloseWorkerPool( terminate ):
+	# wait for the pool workers to exit, or with terminate stop them
+	# with the chains they hold, when there are any
+	global workerPool
+	if( workerPool == None ):
+		return
+	if( terminate ):
+		workerPool.terminate( )
+	else:
+		workerPool.close( )
+	workerPool.join( )
+	workerPool = None
+
+def CreateTables( connection, statements ):
+	# one statement at a time, execute( ) prepares a statement again when
+	# processes that open a new database at the same time change the
+	# schema under it, executescript( ) fails
+	for statement in statements:
+		connection.execute( statement )
+
+def DropChainReports( config, manifest, chain ):
+	# remove the reports the manifest has for a chain that is reported
+	# again, and its runs in the report index
+	headPath = config.LogDir( ) + "/" + chain[ 0 ]
+	for output in manifest.Outputs( headPath ):
+		if( os.path.lexists( output )):
+			os.unlink( output )
+	GetReportIndex( config ).Forget([ config.LogDir( ) + "/" + logFname for logFname in chain ])
+
+def EmitReport( config, logPath, report, last ):
+	# print or write the report of a run of the log at logPath, returns
+	# the paths of the report files that were written
+	outputs = []
+	messages = GetMessageStream( config )
+	if( config.Format( ) == 'json' ):
+		print json.dumps( report.GetRecord( ), sort_keys=True )
+	elif( config.Format( ) == 'csv' ):
+		WriteCsvRecord( report.GetRecord( ))
+	else:
+		PrintReport( report )
+		pdfPath = None
+		if(( report.Error( ) == None ) and ( reportWriter != None )):
+			outputs = reportWriter.Write( config, os.path.basename( logPath ), report, last )
+			pdfPath = outputs[ 0 ]
+		elif( report.Error( ) == None ):
+			outputs = WritePdfReport( config, os.path.basename( logPath ), report, last )
+			pdfPath = outputs[ 0 ]
+		GetReportIndex( config ).Add( logPath, report.GetRecord( ), pdfPath )
+
+	if( report.Error( ) != None ):
+		print >> messages, "Incomplete report generated: ", report.Error( )
+	return outputs
+
+def FileDigest( path ):
+	digest = hashlib.sha1()
+	with open( path, 'rb' ) as f:
+		while( True ):
+			block = f.read( 1024 * 1024 )
+			if( block == "" ):
+				break
+			digest.update( block )
+	return digest.hexdigest()
+
+def FindLogMarkers( text, start, end ):
+	# The ( offset, slot in LogMarkers ) of every marker in text[ start :
+	# end ], in text order. Each marker is looked for with str.find in
+	# LogMarkerBlockSize blocks, which is much faster than matching all
+	# of them at every offset with a regular expression, and creates no
+	# match objects.
+	found = []
+	blockStart = start
+	while( blockStart < end ):
+		blockEnd = min( blockStart + LogMarkerBlockSize, end )
+		block = text[ blockStart : min( blockEnd + LogMarkerOverlap, end )]
+		limit = blockEnd - blockStart
+		for slot, marker in enumerate( LogMarkers ):
+			index = block.find( marker )
+			while(( index != -1 ) and ( index < limit )):
+				found.append(( blockStart + index, slot ))
+				index = block.find( marker, index + 1 )
+		blockStart = blockEnd
+	found.sort( )
+	return found
+
+def FindLogPath( basePath ):
+	# the log file basePath names, which may have been compressed, None
+	# when there is none
+	for suffix in LogSuffixes:
+		if( os.path.exists( basePath + suffix )):
+			return basePath + suffix
+	return None
+
+def GetNextLogPath( config, logPath, tails ):
+	if( logPath.endswith( LogSuffixes[ 1 : ] )):
+		# a compressed log has no tail to read, it is decompressed once
+		# and the successor it names is recorded for the next run
+		nextFileName = tails.Get( logPath )
+		if( nextFileName == None ):
+			resolver = GetLogResolver( config )
+			nextFileName = resolver.GetNextName( resolver.Open( logPath ))
+			tails.Record( logPath, nextFileName )
+		if( nextFileName == "" ):
+			return ""
+		return GetLogPath( config.LogDir( ) + '/' + nextFileName )
+
+	with open( logPath, 'r' ) as f:
+		f.seek( 0, os.SEEK_END )
+		f.seek( max( f.tell( ) - LogTailSize, 0 ))
+		tail = f.read( )
+
+	n3dSearchStr = ":n3d "
+	nextFileNameIndex = tail.rfind( n3dSearchStr )
+	if( nextFileNameIndex == -1 ):
+		return ""
+
+	nextFileName = tail[ nextFileNameIndex + len( n3dSearchStr ) : tail.find( "\n", nextFileNameIndex )].strip()
+	return GetLogPath( config.LogDir( ) + '/' + nextFileName )
+
+def GetChainEnd( config, chain ):
+	# Where the last run of a chain ends, as the log and offset a
+	# RunWindow takes. A chain that goes on in another day's log directory
+	# ends where the first run in the logs there starts, as it would if
+	# they were in its own directory, otherwise at the end of its logs.
+	lastPath = config.LogDir( ) + "/" + chain[ -1 ]
+	try:
+		# the last log is only opened when the successor its tail names
+		# is not in its directory
+		nextPath = GetNextLogPath( config, lastPath, LogTailIndex( config.RptDir( )))
+		if(( nextPath == "" ) or os.path.exists( nextPath )):
+			return None, 0
+		resolver = GetLogResolver( config )
+		log = resolver.Open( lastPath )
+		reached = set( )
+		while( True ):
+			log = resolver.Next( log )
+			if(( log == None ) or ( log.Path( ) in reached )):
+				return None, 0
+			reached.add( log.Path( ))
+			offsets = []
+			for marker in RunStartMarkers:
+				offsets.extend( log.Offsets( marker ))
+			if( len( offsets ) > 0 ):
+				return log, min( offsets )
+	except ( IOError, ValueError ):
+		return None, 0
+
+def GetChainLeaseName( headPath ):
+	# the --shard lease of the chain headed by the log at headPath
+	return "%s_%s.lease" % ( hashlib.sha1( headPath ).hexdigest( )[ :16 ], os.path.basename( headPath ))
+
+def GetLogName( fname ):
+	# the name a :n3d entry gives the log file fname, without its suffix
+	for suffix in LogSuffixes:
+		if( fname.endswith( suffix )):
+			return fname[ : -len( suffix )]
+	return fname
+
+def GetLogNameIndex( config ):
+	# one log name index per process, None when there is no log tree
+	global logNameIndex
+	if( config.LogTree( ) == None ):
+		return None
+	if(( logNameIndex == None ) or ( logNameIndex.Root( ) != config.LogTree( )) or ( logNameIndex.RptDir( ) != config.RptDir( ))):
+		logNameIndex = LogNameIndex( config.LogTree( ), config.RptDir( ))
+	return logNameIndex
+
+def GetLogPath( basePath ):
+	# the log file basePath names, which may have been compressed, the
+	# uncompressed name when there is none
+	path = FindLogPath( basePath )
+	if( path == None ):
+		return basePath + LogSuffixes[ 0 ]
+	return path
+
+def GetLogResolver( config ):
+	# one resolver per process, so a log reached from several chain
+	# heads is only indexed once
+	global logResolver
+	if( logResolver == None ):
+		logResolver = LogChainResolver( config.MaxMapped( ), GetRunProfile( config ), GetLogStage( config ),
+			config.Follow( ), config.MapSize( ), GetLogSummaryCache( config ), GetLogNameIndex( config ))
+	return logResolver
+
+def GetLogRunIndex( config ):
+	# one run index per process, like the report index
+	global logRunIndex
+	if(( logRunIndex == None ) or ( logRunIndex.RptDir( ) != config.RptDir( ))):
+		logRunIndex = LogRunIndex( config.RptDir( ))
+	return logRunIndex
+
+def GetLogStage( config ):
+	# one stage per process, None unless --stagedir is given, logs that
+	# are still being written are never staged
+	global logStage
+	if(( logStage == None ) and ( config.StageDir( ) != None ) and ( not config.Follow( ))):
+		logStage = LogStage( config.StageDir( ), config.StageSize( ) * 1024 * 1024 )
+	return logStage
+
+def GetLogSummaryCache( config ):
+	# one summary cache per process, None unless --summarysize is given,
+	# the logs that are still being written are never summarized
+	global logSummaryCache
+	if(( config.SummarySize( ) == 0 ) or config.Follow( )):
+		return None
+	if(( logSummaryCache == None ) or ( logSummaryCache.RptDir( ) != config.RptDir( ))):
+		logSummaryCache = LogSummaryCache( config.RptDir( ), config.SummarySize( ) * 1024 * 1024 )
+	return logSummaryCache
+
+def GetManifestEntry( config, chain, outputs ):
+	files = []
+	for fname in chain:
+		path = config.LogDir( ) + "/" + fname
+		st = os.stat( path )
+		files.append([ path, st.st_size, st.st_mtime, FileDigest( path )])
+	return { 'files' : files, 'outputs' : outputs }
+
+def GetMessageStream( config ):
+	# only the pdf format prints a human readable report to stdout,
+	# the other formats keep stdout for the records
+	if( config.Format( ) == 'pdf' ):
+		return sys.stdout
+	return sys.stderr
+
+def GetPdfReportPaths( config, logFname, report, last ):
+	# the by_date and by_bcode paths of the pdf report of a run, the last
+	# run in a log file keeps the name its report always had, the reports
+	# of the runs before it are told apart by run number
+	runSuffix = ''
+	if( not last ):
+		runSuffix = '_r' + str( report.Run( ))
+
+	# a filename that sorts by data collection date, and one for the hard
+	# link to it that sorts on barcode
+	ccode = report.GetCCode( )
+	nameByDate = string.split( logFname, '.' )[0] + '_' + report.Barcode( ) + runSuffix
+	nameByBcode = report.Barcode( ) + runSuffix + '_' + string.split( logFname, '.' )[0] 
+	return [ config.RptDir( ) + '/by_date/' + nameByDate + '_' + ccode + '.pdf',
+		config.RptDir( ) + '/by_bcode/' + nameByBcode + '_' + ccode + '.pdf' ]
+
+def GetPdfTemplate( ):
+	global pdfTemplate
+	if( pdfTemplate == None ):
+		pdfTemplate = PdfReportTemplate( )
+	return pdfTemplate
+
+def GetReportIndex( config ):
+	# one report index per process, it only opens reports.db to save
+	global reportIndex
+	if(( reportIndex == None ) or ( reportIndex.RptDir( ) != config.RptDir( ))):
+		reportIndex = ReportIndex( config.RptDir( ))
+	return reportIndex
+
+def GetRptInfoFromFname( logFname ):
+	bname = string.split( logFname, '.' )
+	return string.split( bname, '_' )
 
+def GetTempPath( path ):
+	# the name path is written under before it is renamed into place,
+	# unique to the host, process and thread that writes it
+	return "%s.%s.%d.%d.tmp" % ( path, socket.gethostname( ), os.getpid( ), threading.current_thread( ).ident )
+
+def GetRunProfile( config ):
+	# one profile per process, it does nothing unless --profile is given
+	global runProfile
+	if( runProfile == None ):
+		if( config.Profile( )):
+			runProfile = RunProfile( )
+		else:
+			runProfile = NullProfile( )
+	return runProfile
+
+def GetWorkerPool( config ):
+	# one pool of --jobs workers per process, kept until CloseWorkerPool
+	global workerPool
+	if( workerPool == None ):
+		workerPool = Pool( config.Jobs( ), InitWorker )
+	return workerPool
+
+def IsoDate( mmddyyyy ):
+	# mm/dd/yyyy as yyyy-mm-dd, None stays None
+	if( mmddyyyy == None ):
+		return None
+	return mmddyyyy[ 6: ] + "-" + mmddyyyy[ 0:2 ] + "-" + mmddyyyy[ 3:5 ]
+
+def LoadJson( path ):
+	# what the JSON file at path holds, {} when there is none
+	if( not os.path.exists( path )):
+		return {}
+	with open( path, 'r' ) as f:
+		return json.load( f )
+
+def ParseDate( mmddyyyy ):
+	# mm/dd/yyyy as a date
+	return date( int( mmddyyyy[ 6: ] ), int( mmddyyyy[ 0:2 ] ), int( mmddyyyy[ 3:5 ] ))
+
+def ParseLineStamp( line ):
+	# Break the line into words. The first two words are
+	# 3 letter month and 0 suppressed day. Change to mm/dd/yyyy.
+	lineField = line.split( None, 6 )
+	reportYear = lineField[ 5 ][ 7:11 ]
+	rundate = NumericMonth[ lineField[ 0 ]] + "/" + lineField[ 1 ].zfill(2) + "/" + reportYear
+
+	# the next field is the time stamp of when the sample
+	# was processed. Just use the hh:mm:ss
+	runtime = lineField[ 2 ][ 0:8 ]
+	return ( rundate, runtime )
+
+def PassFail( passed ):
+	if( passed == True ):
+		return "pass"
+	return "fail"
+
+def PdfString( text ):
+	# a pdf literal string in the font's WinAnsi encoding
+	if( isinstance( text, unicode )):
+		text = text.encode( 'cp1252', 'replace' )
+	return text.replace( "\\", "\\\\" ).replace( "(", "\\(" ).replace( ")", "\\)" ).replace( "\r", "" )
+
+def PlanLogDir( config ):
+	# Group the files of the log directory into :n3d chains, reading the
+	# successor of each file from its tail without mapping it. Returns
+	# the chains as lists of file names, each starting with its head, in
+	# chronological (file name) order of the heads.
+	logFnames = []
+	for fname in sorted( os.listdir( config.LogDir( ))):
+		if( os.path.isfile( config.LogDir( ) + "/" + fname )):
+			logFnames.append( fname )
+	isLogFname = set( logFnames )
+
+	successors = {}
+	tails = LogTailIndex( config.RptDir( ))
+	for fname in logFnames:
+		try:
+			nextPath = GetNextLogPath( config, config.LogDir( ) + "/" + fname, tails )
+		except ( IOError, ValueError ):
+			continue
+		if( nextPath != "" ):
+			successors[ fname ] = os.path.basename( nextPath )
+	tails.Save( )
+
+	# a head is a file no other file continues in, files that are only
+	# reached from a cycle of n3d entries start a chain of their own
+	continued = set( successors.values( ))
+	heads = [ fname for fname in logFnames if fname not in continued ]
+
+	chains = []
+	assigned = set( )
+	for head in heads + logFnames:
+		chain = []
+		fname = head
+		while(( fname in isLogFname ) and ( fname not in assigned )):
+			chain.append( fname )
+			assigned.add( fname )
+			fname = successors.get( fname )
+		if( len( chain ) > 0 ):
+			chains.append( chain )
+	return chains
+
+def PlanRuns( config, chain ):
+	# the runs of a chain as ( log file name, run, last, window, log,
+	# offset of the :USER: start entry ), where run numbers the runs of
+	# a log file from 1 and last is set for the last run in its file
+	messages = GetMessageStream( config )
+	resolver = GetLogResolver( config )
+
+	# one forward pass over the chain, collecting the start entries of
+	# its runs as ( log file name, log, offset ) in chain order
+	profile = GetRunProfile( config )
+	stage = GetLogStage( config )
+	if( stage != None ):
+		# copy the rest of the chain while its head is read
+		stage.Prefetch([ config.LogDir( ) + "/" + logFname for logFname in chain[ 1 : ]])
+
+	# a log that no run starts in is only opened here when it has changed
+	# since that was recorded, otherwise only when a run continues into it
+	runIndex = GetLogRunIndex( config )
+	starts = []
+	for logFname in chain:
+		logPath = config.LogDir( ) + "/" + logFname
+		if( runIndex.Get( logPath ) == 0 ):
+			continue
+		profile.Begin( logFname )
+		try:
+			mm = resolver.Open( logPath )
 		except ValueError as detail:
-			print "Incomplete report generated: ", detail
+			print >> messages, "Incomplete report generated: ", detail
+			break
+		offsets = []
+		for marker in RunStartMarkers:
+			offsets.extend( mm.Offsets( marker ))
+		runIndex.Record( logPath, len( offsets ))
+		for userStartIndex in sorted( offsets ):
+			starts.append(( logFname, mm, userStartIndex ))
+
+	endLog, endIndex = None, 0
+	if( len( starts ) > 0 ):
+		endLog, endIndex = GetChainEnd( config, chain )
+
+	runs = []
+	run = 0
+	for i, ( logFname, mm, userStartIndex ) in enumerate( starts ):
+		if( i + 1 < len( starts )):
+			window = RunWindow( resolver, starts[ i + 1 ][ 1 ], starts[ i + 1 ][ 2 ] )
+		else:
+			window = RunWindow( resolver, endLog, endIndex )
+
+		if(( i == 0 ) or ( starts[ i - 1 ][ 0 ] != logFname )):
+			run = 0
+		run += 1
+		last = ( i + 1 == len( starts )) or ( starts[ i + 1 ][ 0 ] != logFname )
+		runs.append(( logFname, run, last, window, mm, userStartIndex ))
+	return runs
+
+def PrintReport( report ):
+	for x, y, text in report.GetLines( ):
+		if(( text == ReportTitle ) or ( text == 'Processes:' )):
+			print
+		print text
+
+def ProcessBackfill( config ):
+	# Every day of every instrument of the backfill is reported like a
+	# run of its own, one after the other in this process, so the chains
+	# of each day are still shared out over --jobs workers, the same ones
+	# for every day. The logs of a day are forgotten before the next one
+	# is read, by this process and by the workers.
+	checkpoint = BackfillCheckpoint( config.Checkpoint( ))
+	units = config.GetUnits( )
+	counts = { 'done': 0, 'skipped': 0, 'missing': 0, 'failed': 0 }
+	chains = 0
+	start = time.time( )
+	try:
+		for i, unit in enumerate( units ):
+			progress = "[%d/%d] %s: " % ( i + 1, len( units ), unit.GetUnitName( ))
+			if(( not config.Force( )) and checkpoint.IsDone( unit )):
+				counts[ 'skipped' ] += 1
+				print >> sys.stderr, progress + "done before"
+				continue
+			if( not os.path.isdir( unit.LogDir( ))):
+				# not done, its logs may still arrive
+				counts[ 'missing' ] += 1
+				checkpoint.Record( unit, 'missing', 0, 0.0 )
+				print >> sys.stderr, progress + "no log directory " + unit.LogDir( )
+				continue
+
+			unitStart = time.time( )
+			try:
+				unitChains = ProcessLogDir( unit )
+			except Exception as detail:
+				counts[ 'failed' ] += 1
+				checkpoint.Record( unit, 'failed', 0, time.time( ) - unitStart )
+				print >> sys.stderr, progress + "failed: " + str( detail )
+				print >> sys.stderr, traceback.format_exc().rstrip()
+				continue
+			finally:
+				CloseLogResolver( )
+
+			seconds = time.time( ) - unitStart
+			counts[ 'done' ] += 1
+			chains += unitChains
+			checkpoint.Record( unit, 'done', unitChains, seconds )
+			print >> sys.stderr, progress + "%d chains reported in %.1f s" % ( unitChains, seconds )
+	finally:
+		CloseWorkerPool( False )
+
+	print >> sys.stderr, "backfill: %d days done, %d done before, %d without logs, %d failed, %d chains, %.1f s" % (
+		counts[ 'done' ], counts[ 'skipped' ], counts[ 'missing' ], counts[ 'failed' ], chains, time.time( ) - start )
+	GetRunProfile( config ).PrintSummary( )
+
+def ProcessFollow( config ):
+	# report the runs of the log directory as they end, until the
+	# follow is interrupted or terminated
+	signal.signal( signal.SIGTERM, StopOnTerm )
+	follower = LogFollower( config )
+	if( config.Format( ) == 'csv' ):
+		WriteCsvHeader( )
+	try:
+		follower.Run( )
+	except KeyboardInterrupt:
+		pass
+	finally:
+		follower.Close( )
+		GetReportIndex( config ).Save( )
+		SaveLogNameIndex( config )
+		GetLogResolver( config ).Close( )
+		GetRunProfile( config ).PrintSummary( )
+
+def ProcessLogChain( chain, config ):
+	# A chain is processed as one unit, so the files that continue its
+	# head are never separate work items, they are only examined through
+	# the resolver that followed them from the head. Every :USER: start
+	# entry in the chain begins a run, and each run gets a report of its
+	# own that only looks at the log up to where the next run starts.
+	outputs = []
+	profile = GetRunProfile( config )
+	for logFname, run, last, window, mm, userStartIndex in PlanRuns( config, chain ):
+		profile.Begin( logFname )
+		outputs += ProcessRun( config, window, logFname, run, last, mm, userStartIndex )
+		profile.Run( window.Depth( ))
+	return outputs
+
+def ProcessRun( config, window, logFname, run, last, mm, userStartIndex ):
+	# returns the paths of the report files that were written
+	report = InitReport( config, window, logFname, run, mm, userStartIndex )
+	return EmitReport( config, mm.Path( ), report, last )
+
+def ProcessServe( config ):
+	# answer report requests until the service is interrupted or
+	# terminated, the pdf template is made before the first one
+	signal.signal( signal.SIGTERM, StopOnTerm )
+	server = ReportServer( config )
+	if( config.Format( ) == 'pdf' ):
+		GetPdfTemplate( )
+	print >> sys.stderr, "serving on", config.Serve( )
+	try:
+		server.serve_forever( )
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close( )
+		GetReportIndex( config ).Save( )
+		SaveLogNameIndex( config )
+		GetLogResolver( config ).Close( )
+
+def QueryReports( config ):
+	records = GetReportIndex( config ).Query( config.GetInstr( ), config.QueryBarcode( ),
+		config.QueryFailed( ), config.QueryFrom( ), config.QueryTo( ))
+	if( config.Format( ) == 'json' ):
+		for record in records:
+			print json.dumps( record, sort_keys=True )
+	elif( config.Format( ) == 'csv' ):
+		writer = csv.writer( sys.stdout )
+		writer.writerow( ReportFields + ( "pdf", ))
+		for record in records:
+			writer.writerow([ record[ field ] for field in ReportFields + ( "pdf", )])
+	else:
+		for record in records:
+			if( record[ "pdf" ] != None ):
+				print record[ "pdf" ]
+
+def ReadCompressedLog( path ):
+	# the text of a compressed log, a block at a time, a log that can't
+	# be decompressed raises ValueError like a log entry that is missing
+	try:
+		for block in ReadCompressedLogBlocks( path ):
+			yield block
+	except zlib.error as detail:
+		raise ValueError( "can't decompress " + os.path.basename( path ) + ": " + str( detail ))
+
+def ReadCompressedLogBlocks( path ):
+	with open( path, 'rb' ) as f:
+		if( path.endswith( ".log.zst" )):
+			if( zstandard == None ):
+				raise ValueError( "zstandard module not installed:" + os.path.basename( path ))
+			for block in zstandard.ZstdDecompressor( ).read_to_iter( f, read_size=LogBlockSize ):
+				yield block
+			return
 
+		# gzip, a file may hold several gzip members one after the other
+		decoder = zlib.decompressobj( 16 + zlib.MAX_WBITS )
+		while( True ):
+			data = f.read( LogBlockSize )
+			if( data == "" ):
+				break
+			while( data != "" ):
+				yield decoder.decompress( data )
+				data = decoder.unused_data
+				if( data != "" ):
+					decoder = zlib.decompressobj( 16 + zlib.MAX_WBITS )
+		yield decoder.flush( )
+
+def ReadLogBlocks( path ):
+	# the text of a log that is not mapped, a block at a time
+	with open( path, 'rb' ) as f:
+		while( True ):
+			block = f.read( LogBlockSize )
+			if( block == "" ):
+				break
+			yield block
+
+def ReleaseChain( config, chain, manifest, leases ):
+	# save the manifest with the chain, under the lease that guards it,
+	# and give up the chain's lease. A chain whose lease another process
+	# took over is left to that process, its entry is not saved.
+	headPath = config.LogDir( ) + "/" + chain[ 0 ]
+	if( not leases.Holds( GetChainLeaseName( headPath ))):
+		manifest.Drop( headPath )
+		print >> GetMessageStream( config ), "Lease lost, chain left to another process: ", chain[ 0 ]
+		return
+	with leases.Hold( ManifestLeaseName ):
+		manifest.Save( )
+	leases.Release( GetChainLeaseName( headPath ))
+
+def SaveLogNameIndex( config ):
+	names = GetLogNameIndex( config )
+	if( names != None ):
+		names.Save( )
+
+def SaveJson( path, value ):
+	# write a new file and rename it into place so an interrupted run
+	# never leaves a truncated one behind
+	tmpPath = GetTempPath( path )
+	with open( tmpPath, 'w' ) as f:
+		json.dump( value, f, indent=1, sort_keys=True )
+	os.rename( tmpPath, path )
+
+def StopOnTerm( signum, frame ):
+	# a terminated follow or service ends like an interrupted one
+	raise KeyboardInterrupt( )
+
+def WriteCsvHeader( ):
+	csv.writer( sys.stdout ).writerow( ReportFields )
+
+def WriteCsvRecord( record ):
+	csv.writer( sys.stdout ).writerow([ record[ field ] for field in ReportFields ])
+
+def WritePdfReport( config, logFname, report, last ):
+	# save the report with a filename that sorts by data collection date
+	fullPathByDate, fullPathByBcode = GetPdfReportPaths( config, logFname, report, last )
+	profile = GetRunProfile( config )
+	with profile.Stage( "pdf", logFname ):
+		GetPdfTemplate( ).Save( fullPathByDate, report.GetLines( ))
+
+	# save a hard link to the report file, and give the hard link a name that sorts on barcode
+	with profile.Stage( "link", logFname ):
+		# a new link renamed over the old one, which is never missing
+		tmpPath = GetTempPath( fullPathByBcode )
+		try:
+			os.link( fullPathByDate, tmpPath )
+			os.rename( tmpPath, fullPathByBcode )
+		finally:
+			if( os.path.lexists( tmpPath )):
+				os.unlink( tmpPath )
+	return [ fullPathByDate, fullPathByBcode ]
+
+def InitWorker( ):
+	# the parent process handles ctrl-c and tears the pool down
+	signal.signal( signal.SIGINT, signal.SIG_IGN )
+
+def ProcessLogChainInWorker( args ):
+	# Runs in a pool worker. Everything ProcessLogChain prints is captured
+	# and handed back with the chain so the parent can print the reports in
+	# chain order, along with the profile records, the report index rows,
+	# the run counts of the logs and the directories of the log tree that
+	# were listed, and any exception stays confined to this chain.
+	global workerLogDir
+	chain, config, summaries = args
+	if( config.LogDir( ) != workerLogDir ):
+		# the pool of a backfill goes on to the next day, the logs of
+		# the day before are forgotten like the parent forgets them
+		CloseLogResolver( )
+		workerLogDir = config.LogDir( )
+	GetLogResolver( config ).AddSummaries( summaries )
+	stdout = sys.stdout
+	sys.stdout = StringIO()
+	try:
+		entry = None
 		try:
-			mm.close()
-		except UnboundLocalError as detail:
-			print "Error closing log file: ", detail
+			if( config.Format( ) == 'pdf' ):
+				entry = ProcessManifestEntry( chain, config )
+			else:
+				ProcessLogChain( chain, config )
+		except Exception as detail:
+			messages = GetMessageStream( config )
+			print >> messages, "Error processing log file " + chain[ 0 ] + ": ", detail
+			print >> messages, traceback.format_exc().rstrip()
+		names = GetLogNameIndex( config )
+		dirs = {}
+		if( names != None ):
+			dirs = names.TakeDirs( )
+		return ( chain, sys.stdout.getvalue(), entry, GetRunProfile( config ).TakeRecords( ),
+			GetReportIndex( config ).TakeRows( ), GetLogRunIndex( config ).TakeEntries( ), dirs )
+	finally:
+		sys.stdout = stdout
+
+def ProcessLogChains( config, chains, manifest, leases ):
+	# With leases, only the chains this process claims are reported, and
+	# each one is saved in the manifest before its lease is given up.
+	global reportWriter
+	profile = GetRunProfile( config )
+	stage = GetLogStage( config )
+	if( config.Jobs( ) == 1 ):
+		readahead = None
+		work = chains
+		if( leases != None ):
+			work = ClaimChains( config, chains, manifest, leases, None )
+		if( config.Pipeline( ) > 0 ):
+			# read ahead on one thread, and write the pdf reports on
+			# another, while the runs are evaluated on this one
+			readahead = LogReadahead( config, work, config.Pipeline( ) + 1 )
+			work = readahead.Chains( )
+			if( config.Format( ) == 'pdf' ):
+				reportWriter = ReportWriter( ReportQueueSize )
+		try:
+			for i, chain in enumerate( work ):
+				if(( stage != None ) and ( readahead == None ) and ( leases == None ) and ( i + 1 < len( chains ))):
+					# copy the head of the next chain while this one is read
+					stage.Prefetch([ config.LogDir( ) + "/" + chains[ i + 1 ][ 0 ]])
+				if( manifest == None ):
+					ProcessLogChain( chain, config )
+				else:
+					manifest.Record( config.LogDir( ) + "/" + chain[ 0 ], ProcessManifestEntry( chain, config ))
+				if( leases != None ):
+					if( reportWriter != None ):
+						# the chain's reports are written before it is saved
+						writer = reportWriter
+						reportWriter = ReportWriter( ReportQueueSize )
+						writer.Close( )
+					ReleaseChain( config, chain, manifest, leases )
+				if(( reportWriter == None ) or ( leases != None )):
+					# the records of the chain's logs are emitted once
+					# the writer thread, if any, has written their reports
+					profile.Emit( profile.TakeRecords( ))
+				if( readahead != None ):
+					readahead.Done( )
+		finally:
+			# an interrupted run stops reading, but writes the reports the
+			# manifest records before it is saved
+			if( readahead != None ):
+				readahead.Close( )
+			if( reportWriter != None ):
+				writer = reportWriter
+				reportWriter = None
+				writer.Close( )
+				profile.Emit( profile.TakeRecords( ))
+		return
+
+	# the workers evaluate and write the chains, with --pipeline each one
+	# once this process has read it ahead of them, and with leases only as
+	# many as there are workers are claimed ahead of the ones reported.
+	# The workers are forked before the reader thread starts, one forked
+	# while it is in the summary cache would wait on its sqlite lock.
+	pool = GetWorkerPool( config )
+	readahead = None
+	slots = None
+	work = chains
+	if( leases != None ):
+		if( config.Pipeline( ) == 0 ):
+			slots = threading.Semaphore( config.Jobs( ))
+		work = ClaimChains( config, chains, manifest, leases, slots )
+	if( config.Pipeline( ) > 0 ):
+		readahead = LogReadahead( config, work, config.Pipeline( ) + config.Jobs( ))
+		work = readahead.Chains( )
+	# the compressed logs the plan decompressed go to the worker with
+	# their chain, which does not decompress them again
+	resolver = GetLogResolver( config )
+	try:
+		results = pool.imap( ProcessLogChainInWorker, (( chain, config,
+			resolver.GetSummaries([ config.LogDir( ) + "/" + fname for fname in chain ])) for chain in work ))
+		for chain, output, entry, records, rows, runs, dirs in results:
+			sys.stdout.write( output )
+			if( entry != None ):
+				manifest.Record( config.LogDir( ) + "/" + chain[ 0 ], entry )
+			profile.Emit( records )
+			GetReportIndex( config ).AddRows( rows )
+			GetLogRunIndex( config ).AddEntries( runs )
+			if( len( dirs ) > 0 ):
+				GetLogNameIndex( config ).AddDirs( dirs )
+			if( leases != None ):
+				ReleaseChain( config, chain, manifest, leases )
+			if( slots != None ):
+				slots.release( )
+			if( readahead != None ):
+				readahead.Done( )
+	except:
+		# the reader ends the chains handed to the pool before it stops,
+		# the workers are stopped with the chains they still hold
+		if( readahead != None ):
+			readahead.Close( )
+		CloseWorkerPool( True )
+		raise
+	finally:
+		if( readahead != None ):
+			readahead.Close( )
+
+def ProcessLogDir( config ):
+	profile = GetRunProfile( config )
+	with profile.Stage( "plan" ):
+		chains = PlanLogDir( config )
+
+	if( config.Format( ) != 'pdf' ):
+		# json and csv records go to stdout for every log file, there
+		# are no report files for the manifest to keep track of
+		if( config.Format( ) == 'csv' ):
+			WriteCsvHeader( )
+		try:
+			ProcessLogChains( config, chains, None, None )
+		finally:
+			GetLogRunIndex( config ).Save( )
+			SaveLogNameIndex( config )
+			GetLogResolver( config ).Close( )
+			if( not config.Backfill( )):
+				CloseWorkerPool( False )
+		if( not config.Backfill( )):
+			profile.PrintSummary( )
+		return len( chains )
+
+	manifest = ReportManifest( config.RptDir( ))
+	index = GetReportIndex( config )
+	leases = None
+	if( config.Shard( )):
+		leases = WorkLeases( config.RptDir( ), config.LeaseTime( ))
+
+	# skip the chains that have not changed since the manifest recorded
+	# them, and drop the reports of the ones that are redone, which with
+	# --shard is only done for the chains this process claims
+	pending = []
+	for chain in chains:
+		headPath = config.LogDir( ) + "/" + chain[ 0 ]
+		if(( not config.Force( )) and manifest.IsCurrent( headPath )):
+			continue
+		if( leases == None ):
+			DropChainReports( config, manifest, chain )
+		pending.append( chain )
+
+	try:
+		ProcessLogChains( config, pending, manifest, leases )
+	finally:
+		if( leases != None ):
+			with leases.Hold( ManifestLeaseName ):
+				manifest.Save( )
+			leases.Close( )
+		else:
+			manifest.Save()
+		index.Save( )
+		GetLogRunIndex( config ).Save( )
+		SaveLogNameIndex( config )
+		GetLogResolver( config ).Close( )
+		if( not config.Backfill( )):
+			CloseWorkerPool( False )
+
+	if( not config.Backfill( )):
+		profile.PrintSummary( )
+	print "EOF"
+	return len( pending )
+
+def ProcessManifestEntry( chain, config ):
+	outputs = ProcessLogChain( chain, config )
+	return GetManifestEntry( config, chain, outputs )
 
 # execution starts here
-config = RunTimeConfig( )
-logdir = config.LogDir( )
-
-for fname in os.listdir( logdir ):
-	ProcessLogFile( fname, config )
-
-print "EOF"
+if __name__ == '__main__':
+	config = RunTimeConfig( )
+	if( config.Query( )):
+		QueryReports( config )
+	elif( config.Backfill( )):
+		ProcessBackfill( config )
+	elif( config.Follow( )):
+		ProcessFollow( config )
+	elif( config.Serve( ) != None ):
+		ProcessServe( config )
+	else:
+		ProcessLogDir( config )
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+
+#
+# genUcmLogs.py
+#
+#    This script writes synthetic ucm log files for exercising and timing
+#    dailyInitReport.py. The command line options are as follows:
+#
+#        --logdir=<abspath>     the directory the log files are written to
+#        --instr=cctXXX         the cell ct hostname the logs are written for (default cct032)
+#        --logdate=mm/dd/yyyy   the date the logs are written for (default 10/17/2015)
+#        --chains=N             write N :n3d chains of log files (default 1)
+#        --chainlen=N           the number of log files in each chain (default 3)
+#        --runs=N               the number of runs per log file (default 3)
+#        --size=KB              the approximate size of each log file (default 256)
+#        --absy=N               the number of ":cap is" entries per run (default 10)
+#        --absyvalues=N         the most values in an absY=[...] entry (default 4)
+#        --stop=STAGE           place a :USER: Stop before STAGE (default none)
+#        --stoprate=P           the fraction of runs that are stopped (default 0.2)
+#        --fifteen=STAGE        place a "Fifteen minute" timeout before STAGE (default none)
+#        --fifteenrate=P        the fraction of runs that time out (default 0.2)
+#        --seed=N               the random seed, the same options and seed write the same logs
+#
+#    STAGE is one of findcap, illumcal, pvtest, capcal, datacol or none. The
+#    entries of a chain are generated as one stream and cut into log files
+#    of about the same size, so runs cross from one log file into the next
+#    the way they do when the ucm rolls its log over in the middle of a run.
+#    Each log file but the last in its chain ends with the :n3d entry that
+#    names its successor.
+
+import os
+import calendar
+import random
+import time
+
+from optparse import OptionParser
+
+RunStages = ( "findcap", "illumcal", "pvtest", "capcal", "datacol" )
+
+# the ucm entries that fill the log between the ones the report looks for,
+# none of them contains a marker that dailyInitReport.py searches for
+NoiseEntries = (
+	"stage pos x=%d y=%d z=%d",
+	"temp sensor %d reading %.2f",
+	"pump state idle pos=%d rate=%d",
+	"camera frame %d exposure %d gain %d",
+	"heartbeat %d" )
+
+class LogLine:
+	def __init__( self, when, text ):
+		self._when = when
+		self._text = text
+
+	def GetText( self, logBase, instr ):
+		# "Oct 17 12:00:04.255 cct032 ucm[2041]: cct032_20151017_120000 text",
+		# the day is space padded the way syslog writes it
+		stamp = time.gmtime( self._when )
+		return "%s %2d %s.%03d %s ucm[2041]: %s %s" % (
+			time.strftime( "%b", stamp ), stamp.tm_mday, time.strftime( "%H:%M:%S", stamp ),
+			int( self._when * 1000 ) % 1000, instr, logBase, self._text )
+
+	def When( self ):
+		return self._when
+
+class LogStream:
+	def __init__( self, rng, start, noiseLines ):
+		self._rng = rng
+		self._when = start
+		self._noiseLines = noiseLines
+		self._lines = []
+
+	def Add( self, text ):
+		self._when += self._rng.uniform( 0.001, 2.0 )
+		self._lines.append( LogLine( self._when, text ))
+
+	def AddNoise( self ):
+		# a random number of filler entries, noiseLines of them on average
+		for i in range( self._rng.randint( 0, 2 * self._noiseLines )):
+			entry = self._rng.choice( NoiseEntries )
+			self.Add( entry % tuple( self._rng.randint( 0, 9999 ) for n in range( entry.count( "%" ))))
+
+	def Lines( self ):
+		return self._lines
+
+def GetOptionParser( ):
+	parser = OptionParser()
+	parser.add_option( "-l", "--logdir", dest="logdir", help="log file directory" )
+	parser.add_option( "-i", "--instr", dest="instr", default="cct032", help="instrument id" )
+	parser.add_option( "-d", "--logdate", dest="logdate", default="10/17/2015", help="log date" )
+	parser.add_option( "--chains", dest="chains", type="int", default=1, help="number of n3d chains" )
+	parser.add_option( "--chainlen", dest="chainlen", type="int", default=3, help="log files per chain" )
+	parser.add_option( "--runs", dest="runs", type="int", default=3, help="runs per log file" )
+	parser.add_option( "--size", dest="size", type="int", default=256, help="log file size (KB)" )
+	parser.add_option( "--absy", dest="absy", type="int", default=10, help="cap is entries per run" )
+	parser.add_option( "--absyvalues", dest="absyvalues", type="int", default=4, help="most values per absY entry" )
+	parser.add_option( "--stop", dest="stop", default="none", choices=RunStages + ( "none", ), help="stage a user stop comes before" )
+	parser.add_option( "--stoprate", dest="stoprate", type="float", default=0.2, help="fraction of runs stopped" )
+	parser.add_option( "--fifteen", dest="fifteen", default="none", choices=RunStages + ( "none", ), help="stage a fifteen minute timeout comes before" )
+	parser.add_option( "--fifteenrate", dest="fifteenrate", type="float", default=0.2, help="fraction of runs timed out" )
+	parser.add_option( "--seed", dest="seed", type="int", default=0, help="random seed" )
+	return parser
+
+def GetNoiseLines( options ):
+	# the filler entries to add in each of the 7 gaps a run leaves between
+	# its report entries so that a log file comes out at about options.size
+	# KB, a log line is about 80 bytes and a run writes about 16 + 2 *
+	# options.absy report entries of its own
+	linesPerRun = options.size * 1024 / 80 / options.runs
+	return max(( linesPerRun - 16 - 2 * options.absy ) / 7, 0 )
+
+def WriteChain( options, rng, start ):
+	stream = LogStream( rng, start, GetNoiseLines( options ))
+	for run in range( options.runs * options.chainlen ):
+		stream.AddNoise( )
+		WriteRun( options, rng, stream )
+	stream.AddNoise( )
+
+	# cut the stream into chainlen log files of about the same number
+	# of lines, each file is named for the time of its first entry
+	lines = stream.Lines( )
+	cuts = [ len( lines ) * i / options.chainlen for i in range( options.chainlen + 1 )]
+	logBases = []
+	for i in range( options.chainlen ):
+		first = time.gmtime( lines[ cuts[ i ]].When( ))
+		logBases.append( options.instr + "_" + time.strftime( "%Y%m%d_%H%M%S", first ))
+
+	for i in range( options.chainlen ):
+		logBase = logBases[ i ]
+		with open( options.logdir + "/" + logBase + ".log", "w" ) as f:
+			for line in lines[ cuts[ i ] : cuts[ i + 1 ]]:
+				f.write( line.GetText( logBase, options.instr ) + "\n" )
+			if( i + 1 < options.chainlen ):
+				last = lines[ cuts[ i + 1 ] - 1 ]
+				f.write( LogLine( last.When( ), ":n3d " + logBases[ i + 1 ] ).GetText( logBase, options.instr ) + "\n" )
+	return lines[ -1 ].When( )
+
+def WriteLogDir( options ):
+	if( options.logdir == None ):
+		raise RuntimeError( "missing argument (logdir)" )
+	if(( options.chains < 1 ) or ( options.chainlen < 1 ) or ( options.runs < 1 )):
+		raise RuntimeError( "invalid argument (chains, chainlen or runs)" )
+	if( not os.path.isdir( options.logdir )):
+		os.makedirs( options.logdir )
+
+	rng = random.Random( options.seed )
+	start = calendar.timegm( time.strptime( options.logdate, "%m/%d/%Y" ))
+	for chain in range( options.chains ):
+		# leave a gap between chains so that no two files share a name
+		start = WriteChain( options, rng, start ) + 3600
+
+def WriteRun( options, rng, stream ):
+	stream.Add( rng.choice(( ":USER: Start", ":USER: Restart", ":USER: Run" )))
+	stream.AddNoise( )
+	stream.Add( "spe specimen loaded tray=%d" % rng.randint( 1, 8 ))
+	stream.Add( "spe info specimencategory=%s disposable=BC%05d lot=%d" % (
+		rng.choice(( "blood", "sputum" )), rng.randint( 0, 99999 ), rng.randint( 0, 999 )))
+
+	stop = ( options.stop != "none" ) and ( rng.random( ) < options.stoprate )
+	fifteen = ( options.fifteen != "none" ) and ( rng.random( ) < options.fifteenrate )
+	for stage in RunStages:
+		if( fifteen and ( stage == options.fifteen )):
+			stream.Add( "Fifteen minute timeout waiting for %s" % stage )
+		if( stop and ( stage == options.stop )):
+			stream.Add( ":USER: Stop" )
+			return
+		stream.AddNoise( )
+
+		if( stage == "findcap" ):
+			for i in range( options.absy ):
+				stream.Add( ":cap is searching focus=%d" % rng.randint( 0, 999 ))
+				values = [ "%.2f" % rng.uniform( 0.0, 200.0 ) for n in range( rng.randint( 0, options.absyvalues ))]
+				stream.Add( "absY=[" + " ".join( values ) + "]" )
+			if( rng.random( ) < 0.2 ):
+				stream.Add( ":USER: Coarse Focus Control  RESET" )
+		elif( stage == "illumcal" ):
+			if( rng.random( ) < 0.8 ):
+				stream.Add( ":cal success illum=%d" % rng.randint( 0, 255 ))
+		elif( stage == "pvtest" ):
+			for i in range( rng.randint( 1, 3 )):
+				stream.Add( "Pressure/PumpPos Slope %s" % rng.choice(( "NaN", "%.4f" % rng.uniform( -1.0, 1.0 ))))
+		elif( stage == "capcal" ):
+			for i in range( rng.randint( 1, 3 )):
+				stream.Add( "mode=capcal status=%s" % rng.choice(( "success", "fail" )))
+		elif( stage == "datacol" ):
+			if( rng.random( ) < 0.8 ):
+				stream.Add( ":pse collecting frames=%d" % rng.randint( 1, 500 ))
+
+if __name__ == '__main__':
+	(options, args) = GetOptionParser( ).parse_args()
+	WriteLogDir( options )